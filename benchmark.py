@@ -0,0 +1,218 @@
+"""
+benchmark.py
+
+Benchmarks of the hot paths of the simulation across grid sizes.
+Every case is timed for each N from 128 to 10^5: building the Crank-Nicolson operator, one time step, the physics and the drawing of an
+animation frame, parsing and evaluating a Function, normalizing the wavefunction and the sketch helpers change_array and rescales_array.
+The results are written to a JSON file and compared against a stored baseline, and any case that got slower than the threshold allows
+is reported, so scaling regressions are caught before they are deployed.
+
+Run this file for the benchmarks, for example
+python benchmark.py --output results.json --baseline benchmark_baseline.json
+"""
+
+#import statements
+import argparse
+import json
+import platform
+import sys
+import time
+from timeit import Timer
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")
+from collection import Function, constant, change_array, rescales_array
+from mechanics import WaveFunctionCreator, UnitaryOperation
+
+# The grid sizes timed by default
+sizes = (128, 512, 2048, 8192, 32768, 100000)
+
+
+def _grid(N):
+    """Return the x grid of N points."""
+    C = constant(N=N)
+    return np.linspace(C.x0, (C.L + C.x0), N)
+
+
+def _gaussian(x):
+    """The default wavefunction."""
+    return np.exp(-0.5*((x - 0.25)/0.05)**2)
+
+
+def unitary_build(N):
+    """Building the Crank-Nicolson operator."""
+    V = _grid(N)**2/2
+    return lambda: UnitaryOperation(V, N=N)
+
+
+def step(N):
+    """One Crank-Nicolson time step."""
+    x = _grid(N)
+    U = UnitaryOperation(x**2/2, N=N)
+    psi = WaveFunctionCreator(_gaussian(x).astype(np.complex128), N=N)
+    return lambda: U(psi)
+
+
+def _quantum(N):
+    """Return an animation of N points, drawn once so that only the frames are timed."""
+    from qmanimate import Quantum
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    q = Quantum(N=N)
+    # Benchmarks take far more steps than a run, so the norm is still checked but the precision is never raised mid-benchmark
+    q.norm_monitor.threshold = np.inf
+    FigureCanvasAgg(q.figure).draw()
+    return q
+
+
+def animate_physics(N):
+    """The physics of an animation frame, the step taken in Quantum._animate."""
+    q = _quantum(N)
+    return q.step
+
+
+def animate_draw(N):
+    """The drawing of an animation frame: Quantum._animate without the step, and redrawing its animated artists the way blitting does."""
+    q = _quantum(N)
+    q.fpi = 0
+    def frame():
+        for artist in q._animate(0):
+            q.ax.draw_artist(artist)
+    return frame
+
+
+def function_parse(N):
+    """Parsing an expression with a free parameter. This does not depend on N."""
+    return lambda: Function("exp(-0.5*((x-a)/0.05)**2)", "x")
+
+
+def function_evaluate(N):
+    """Evaluating a parsed expression on the grid."""
+    x = _grid(N)
+    f = Function("exp(-0.5*((x-a)/0.05)**2)", "x")
+    return lambda: f(x, 0.25)
+
+
+def normalize(N):
+    """Normalizing the wavefunction."""
+    psi = WaveFunctionCreator(_gaussian(_grid(N)).astype(np.complex128), N=N)
+    return psi.normalize
+
+
+def sketch_change_array(N):
+    """collection.change_array, called for every mouse event while sketching."""
+    x = _grid(N)
+    y = _gaussian(x)
+    return lambda: change_array(x, y, 0.1, 0.5)
+
+
+def sketch_rescales_array(N):
+    """collection.rescales_array, called when the potential is rescaled with the mouse wheel."""
+    x = _grid(N)
+    y = x**2
+    return lambda: rescales_array(1.1*x, x, y)
+
+
+# Each case makes the function to time for a grid of N points. The setup it does first is not timed.
+cases = {"unitary_build": unitary_build, "step": step, "animate_physics": animate_physics, "animate_draw": animate_draw,
+         "function_parse": function_parse, "function_evaluate": function_evaluate, "normalize": normalize,
+         "sketch_change_array": sketch_change_array, "sketch_rescales_array": sketch_rescales_array}
+
+
+def measure(function, repeat=5, min_time=0.05):
+    """Return the seconds one call of function takes: the best of repeat runs of as many calls as fill min_time."""
+    timer = Timer(function)
+    # Like Timer.autorange, with a target that can be shorter than its 0.2 seconds
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    return min(timer.repeat(repeat, number))/number
+
+
+def run(names=None, Ns=sizes, repeat=5, min_time=0.05, budget=1.0, verbose=True):
+    """Time the cases called names (all of them if None) for every N in Ns and return the results with a description of the machine.
+    Once one call of a case takes longer than budget seconds its larger sizes are skipped and recorded as None."""
+    results = {}
+    for name in (names or cases):
+        results[name] = {}
+        too_slow = False
+        for N in Ns:
+            if too_slow:
+                results[name][str(N)] = None
+                continue
+            seconds = measure(cases[name](N), repeat, min_time)
+            results[name][str(N)] = seconds
+            too_slow = seconds > budget
+            if verbose:
+                print("%-22s N=%-7d %12.3f us" % (name, N, seconds*1e6))
+    import scipy
+    machine = {"python": platform.python_version(), "numpy": np.__version__, "scipy": scipy.__version__, "matplotlib": matplotlib.__version__,
+               "platform": platform.platform(), "processor": platform.processor() or platform.machine(), "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+    return {"machine": machine, "results": results}
+
+
+def compare(current, baseline, threshold=1.5):
+    """Compare two benchmark results and return the regressions, as (case, N, current seconds, baseline seconds) for every time
+    that is more than threshold times the baseline. Cases and sizes missing from either result are not compared."""
+    regressions = []
+    for name, times in current["results"].items():
+        for N, seconds in times.items():
+            reference = baseline["results"].get(name, {}).get(N)
+            if seconds is not None and reference is not None and seconds > threshold*reference:
+                regressions.append((name, int(N), seconds, reference))
+    return regressions
+
+
+def scaling(result, name, Ns=None):
+    """Return the exponent p of the fit time ~ N^p of a case, from its two largest timed sizes among Ns (among all sizes if None)."""
+    points = sorted((int(N), seconds) for N, seconds in result["results"][name].items() if seconds is not None and (Ns is None or N in Ns))
+    if len(points) < 2:
+        return None
+    (N1, t1), (N2, t2) = points[-2:]
+    return np.log(t2/t1)/np.log(N2/N1)
+
+
+def main(argv=None):
+    """Run the benchmarks from the command line, save them and compare them against the baseline."""
+    parser = argparse.ArgumentParser(description="Benchmarks of the simulation hot paths across grid sizes.")
+    parser.add_argument("--cases", nargs="*", default=None, choices=sorted(cases), help="cases to run, all of them by default")
+    parser.add_argument("--sizes", nargs="*", type=int, default=list(sizes), help="grid sizes N")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case, the best one counts")
+    parser.add_argument("--budget", type=float, default=1.0, help="skip the larger sizes of a case once a call takes longer than this many seconds")
+    parser.add_argument("--output", default="benchmark_results.json", help="output JSON file")
+    parser.add_argument("--baseline", default="benchmark_baseline.json", help="baseline JSON file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.5, help="report cases slower than this many times the baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="also save the results as the new baseline")
+    args = parser.parse_args(argv)
+    current = run(args.cases, args.sizes, args.repeat, budget=args.budget)
+    with open(args.output, "w") as f:
+        json.dump(current, f, indent=1)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(current, f, indent=1)
+        print("Saved the baseline to %s" % args.baseline)
+        return 0
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print("No baseline at %s, run with --save-baseline to make one" % args.baseline)
+        return 0
+    if baseline["machine"]["processor"] != current["machine"]["processor"]:
+        print("The baseline was measured on %s, these times may not be comparable" % baseline["machine"]["processor"])
+    for name in current["results"]:
+        if name in baseline["results"]:
+            # Both are fit on the same sizes, so that the exponents can be compared
+            Ns = set(current["results"][name]) & set(baseline["results"][name])
+            now, before = scaling(current, name, Ns), scaling(baseline, name, Ns)
+            if now is not None and before is not None:
+                print("%-22s scales as N^%.2f, baseline N^%.2f" % (name, now, before))
+    regressions = compare(current, baseline, args.threshold)
+    for name, N, seconds, reference in regressions:
+        print("REGRESSION %-22s N=%-7d %.3g s, baseline %.3g s (%.1fx)" % (name, N, seconds, reference, seconds/reference))
+    if not regressions:
+        print("No regressions against %s" % args.baseline)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,77 @@
+"""
+checkpoint.py
+
+Checkpoints of a simulation.
+A checkpoint is a NumPy .npz file holding psi, the potential the operator was built from and, optionally, the arrays of the operator itself,
+next to a JSON header with the constants, the method, the expressions, their parameters, the time and the speed.
+Restoring one parses no expression and, when the operator was saved, factors no matrix, see Simulation.from_checkpoint.
+Nothing in the file is pickled, so a checkpoint can be loaded safely on another machine.
+
+This module is only a collection of functions, so there is no point in running it.
+"""
+
+#import statements
+import json
+import numpy as np
+from collection import evaluate
+from mechanics import propagators, propagators_2d
+
+# Bumped whenever the layout of the file changes
+version = 1
+
+
+def save_checkpoint(simulation, path, operator=False, compress=False):
+    """Save the state of simulation to the file path. If operator is True the built operator is saved too, so it is not rebuilt on restore."""
+    psi_base = simulation.psi_base
+    V_base = simulation.V_base
+    header = {"version": version, "constants": simulation._get_constant_dict(), "method": simulation.method,
+              "method_options": simulation.method_options, "t": simulation._t, "fpi": simulation.fpi, "absorbed": np.asarray(simulation.absorbed).tolist(),
+              "psi_name": simulation.psi_name, "psi_latex": simulation.psi_latex, "V_name": simulation.V_name, "V_latex": simulation.V_latex,
+              "psi_expression": None if psi_base is None else str(psi_base), "V_expression": None if V_base is None else str(V_base),
+              "psi_params": {i: [str(name), float(value)] for i, (name, value) in simulation.psi_params.items()},
+              "V_params": {i: [str(name), float(value)] for i, (name, value) in simulation.V_params.items()}, "operator": None}
+    V = simulation._V_unitary
+    if callable(V):
+        # Sampled on the grid, which gives the same operator as the expression did
+        V = evaluate(V, simulation.x)
+    arrays = {"psi": simulation.psi.x, "V": np.asarray(V)}
+    # The operator of a time dependent potential holds the function V(x, t), which cannot be saved without pickling it
+    if operator and simulation.U_t is not None and getattr(simulation, "V_t", None) is None:
+        tuples = {}
+        for name, value in simulation.U_t.__getstate__().items():
+            if isinstance(value, tuple):
+                tuples[name] = len(value)
+                for i, item in enumerate(value):
+                    arrays["operator/%s/%d" % (name, i)] = item
+            else:
+                arrays["operator/" + name] = np.asarray(value)
+        header["operator"] = {"class": type(simulation.U_t).__name__, "tuples": tuples}
+    arrays["header"] = np.array(json.dumps(header))
+    with open(path, "wb") as f:
+        (np.savez_compressed if compress else np.savez)(f, **arrays)
+
+
+def load_checkpoint(path):
+    """Load the file path and return its header, psi, the potential and the operator, which is None if it was not saved."""
+    with np.load(path, allow_pickle=False) as data:
+        header = json.loads(str(data["header"]))
+        if header["version"] != version:
+            raise ValueError("%s is a version %s checkpoint, this is version %d" % (path, header["version"], version))
+        psi = data["psi"]
+        V = data["V"]
+        operator = None
+        if header["operator"] is not None:
+            state = {}
+            for key in data.files:
+                if key.startswith("operator/") and key.count("/") == 1:
+                    value = data[key]
+                    state[key[len("operator/"):]] = value.item() if value.ndim == 0 else value
+            for name, n in header["operator"]["tuples"].items():
+                state[name] = tuple(data["operator/%s/%d" % (name, i)] for i in range(n))
+            classes = {cls.__name__: cls for cls in list(propagators.values()) + list(propagators_2d.values())}
+            operator = classes[header["operator"]["class"]].__new__(classes[header["operator"]["class"]])
+            operator.__setstate__(state)
+    # JSON keys are strings, the parameter dicts are keyed by the parameter's index
+    for params in ("psi_params", "V_params"):
+        header[params] = {int(i): value for i, value in header[params].items()}
+    return header, psi, V, operator
\ No newline at end of file
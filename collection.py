@@ -16,8 +16,9 @@ This module is only a collection of functions and classes, so there is no point
 
 #import statements
 import numpy as np
-from sympy import lambdify, abc, latex
-from sympy.parsing.sympy_parser import parse_expr
+import warnings
+from timing import timers
+# SymPy is only imported once an expression is parsed, since importing it takes longer than starting the rest of the application
 
 class VariableNotFoundError(Exception):
     """This class is the variable not found error."""
@@ -27,13 +28,20 @@ class VariableNotFoundError(Exception):
         return "Variable not found"
 
 
+# The complex dtype of the wavefunction, the operators and their buffers for each precision
+precisions = {"single": np.complex64, "double": np.complex128}
+
+
+class SlowEvaluationWarning(RuntimeWarning):
+    """This warning is issued when a function cannot take a whole array and has to be evaluated point by point."""
+
+
 def rectangle(x):
     """Rectangle function that is essentially the simulation space"""
-    try:
+    if isinstance(x, np.ndarray):
         #uses numpy array
-        return np.array([1.0 if (x_i < 0.5 and x_i > -0.5) else 0 for x_i in x])
-    except:
-        return 1.0 if (x < 0.5 and x > -0.5) else 0.
+        return np.where((x < 0.5) & (x > -0.5), 1.0, 0.0)
+    return 1.0 if (x < 0.5 and x > -0.5) else 0.
 
 
 # Dictionary of modules and user defined functions. Used for lambdify from sympy to parse input.
@@ -57,11 +65,46 @@ def noise(x):
     """This is the noise function that will be used by other modules to parse values"""
     if isinstance(x, np.ndarray):
         #uses numpy array
-        return np.array([2.0*np.random.rand() - 1.0 for _ in range(len(x))])
+        return 2.0*np.random.rand(*x.shape) - 1.0
     else:
         return 2.0*np.random.rand() - 1.0
 
 
+def evaluate(function, x):
+    """Evaluate function on the whole array x at once, broadcasting a constant result to the shape of x.
+    If the function cannot take an array, it is evaluated point by point and a SlowEvaluationWarning says so."""
+    try:
+        y = function(x)
+        if np.shape(y) in (np.shape(x), ()):
+            return np.broadcast_to(y, np.shape(x)).copy()
+    except Exception:
+        pass
+    warnings.warn("%s cannot take an array, it is evaluated point by point" % getattr(function, "__name__", function), SlowEvaluationWarning, stacklevel=2)
+    return np.array([function(x_i) for x_i in x])
+
+
+def vectorized(function):
+    """Wrap a function of numbers so that it also takes whole arrays.
+    The function is first called on the array itself. If that fails or returns the wrong shape,
+    a SlowEvaluationWarning is issued once and from then on the function is evaluated point by point with np.vectorize."""
+    per_point = np.vectorize(function)
+    takes_arrays = [True]
+
+    def wrapper(*args):
+        if takes_arrays[0]:
+            try:
+                y = function(*args)
+                if np.shape(y) == np.broadcast_shapes(*[np.shape(arg) for arg in args]):
+                    return y
+            except Exception:
+                pass
+            takes_arrays[0] = False
+            warnings.warn("%s cannot take an array, it is evaluated point by point" % getattr(function, "__name__", function), SlowEvaluationWarning, stacklevel=2)
+        return per_point(*args)
+    wrapper.__name__ = getattr(function, "__name__", "function")
+    return wrapper
+
+
 def scales(x, scales_val):
     """This method scales x back into a boundary if it exceeds it."""
     absmaxposval = np.abs(np.amax(x))
@@ -129,44 +172,54 @@ def change_array(x_array, y_array, x, y, gradual=True):
 
 
 class Function:
-    """This function class is of the form y = f(x; a, b, c...) that helps us manipulate and parse functions"""
+    """This function class is of the form y = f(x; a, b, c...) that helps us manipulate and parse functions.
+    With a list of variables it is a function of all of them, for example f(x, y; a, b...) in 2D."""
     module_list = ["numpy", {"rect": rectangle, "noise": noise}]
 
     def __init__(self, function_name, param):
-        """The is the initializer. The parameter must be a string representation of a function, and it needs to be at least a function of x."""
-        if isinstance(param, str):
-            #returns one expression
-            param = parse_expr(param)
-        if function_name == "x":
-            function_name = "1.0*x"
-        #returns one expression
-        self._symbolic_func = parse_expr(function_name)
-        symbol_set = self._symbolic_func.free_symbols
-        if abc.k in symbol_set:
+        """The is the initializer. The parameter must be a string representation of a function, and it needs to be at least a function of x.
+        param can also be a list of variables such as ["x", "y"], of which the function needs to contain at least one."""
+        with timers.stage("parse"):
+            from sympy import lambdify, abc, latex
+            from sympy.parsing.sympy_parser import parse_expr
+            if isinstance(param, (list, tuple)):
+                variables = [parse_expr(p) if isinstance(p, str) else p for p in param]
+            else:
+                variables = [parse_expr(param) if isinstance(param, str) else param]
+            param = variables[0]
+            if function_name == "x":
+                function_name = "1.0*x"
             #returns one expression
-            k_param = parse_expr("k_param")
-            self._symbolic_func = self._symbolic_func.subs(abc.k, k_param)
+            self._symbolic_func = parse_expr(function_name)
             symbol_set = self._symbolic_func.free_symbols
-        symbol_list = list(symbol_set)
-        if param not in symbol_list:
-            raise VariableNotFoundError
-        #changes the formatting of symbols
-        self.latex_repr = latex(self._symbolic_func)
-        symbol_list.remove(param)
-        self.parameters = symbol_list
-        var_list = [param]
-        var_list.extend(symbol_list)
-        self.symbols = var_list
-        #tranforms sympy(lambda) expressions into python expressions
-        self._lambda_func = lambdify(self.symbols, self._symbolic_func, modules=self.module_list)
+            if abc.k in symbol_set:
+                #returns one expression
+                k_param = parse_expr("k_param")
+                self._symbolic_func = self._symbolic_func.subs(abc.k, k_param)
+                symbol_set = self._symbolic_func.free_symbols
+            symbol_list = list(symbol_set)
+            if not any(variable in symbol_list for variable in variables):
+                raise VariableNotFoundError
+            #changes the formatting of symbols
+            self.latex_repr = latex(self._symbolic_func)
+            symbol_list = [s for s in symbol_list if s not in variables]
+            self.parameters = symbol_list
+            self.variables = variables
+            var_list = list(variables)
+            var_list.extend(symbol_list)
+            self.symbols = var_list
+            #tranforms sympy(lambda) expressions into python expressions
+            self._lambda_func = lambdify(self.symbols, self._symbolic_func, modules=self.module_list)
 
 
     def __call__(self, x, *args):
-        """This method calls this class as if it were a function."""
+        """This method calls this class as if it were a function. A function of several variables takes all of them first, e.g. f(x, y, a)."""
+        variables = (x,) + args[:len(self.variables) - 1]
+        args = args[len(self.variables) - 1:]
         if args == ():
             kwargs = self.get_default_values()
             args = (kwargs[s] for s in kwargs)
-        return self._lambda_func(x, *args)
+        return self._lambda_func(*variables, *args)
 
 
     def __str__(self):
@@ -176,6 +229,8 @@ class Function:
 
     def multiply_latex_string(self, var):
         """The string is multiplied as per the symbols in this method"""
+        from sympy import latex
+        from sympy.parsing.sympy_parser import parse_expr
         #returns one expression
         var = parse_expr(var)
         expression = var*self._symbolic_func
@@ -185,12 +240,12 @@ class Function:
 
     def get_default_values(self):
         """This method gets a dict of the suggested default values for each parameter used in this function."""
-        return {s:float(multiplies_var(self.symbols[0], s, self._symbolic_func)) for s in self.parameters}
+        return {s:float(any(multiplies_var(v, s, self._symbolic_func) for v in self.variables)) for s in self.parameters}
 
 
     def get_enumerated_default_values(self):
         """This method gets an enumerated dict of the suggested default values for each parameter used in this function."""
-        return {i: [s, float(multiplies_var(self.symbols[0], s, self._symbolic_func))] for i, s in enumerate(self.parameters)}
+        return {i: [s, float(any(multiplies_var(v, s, self._symbolic_func) for v in self.variables))] for i, s in enumerate(self.parameters)}
 
 
     def get_tupled_default_values(self):
@@ -200,8 +255,9 @@ class Function:
 
 
     def add_function(function_name, new_function) -> None:
-        """This method adds a function to the module"""
-        Function.module_list[1][function_name] = new_function
+        """This method adds a function to the module.
+        Functions of numbers are wrapped so that expressions using them can still be evaluated on whole arrays."""
+        Function.module_list[1][function_name] = vectorized(new_function)
 
 
 class constant:
@@ -209,8 +265,11 @@ class constant:
     It includes the fundamental constant, including mass, hbar, e, dx, dt etc
     It also includes some other random constants needed for graphing"""
 
-    def __init__(self):
-        """This method initializes the constants"""
+    def __init__(self, **constants):
+        """This method initializes the constants.
+        Any of m, hbar, e, x0, L, N, dt, precision, absorber and absorber_strength can be overridden by keyword, e.g. constant(N=4096, dt=1e-6).
+        precision is "single" (complex64, half the memory traffic per step) or "double" (complex128, for accuracy).
+        absorber is the width of an absorbing layer inside each wall, 0 for hard walls, see absorbing_potential."""
         # Mass
         self.m = 1.      
          # Reduced Planck constant        
@@ -229,8 +288,58 @@ class constant:
         self.dt = 0.00001        
         # scales 
         self._scales = (128/self.N)*5e5
+        # Numeric precision of psi and the operators
+        self.precision = "single"
+        # Width of the absorbing layers and the height their potential rises to at the walls
+        self.absorber = 0.
+        self.absorber_strength = 5e4
+        for name, value in constants.items():
+            if name not in ("m", "hbar", "e", "x0", "L", "N", "dt", "precision", "absorber", "absorber_strength"):
+                raise TypeError("%s is not a constant" % name)
+            setattr(self, name, value)
+        if self.precision not in precisions:
+            raise ValueError("Unknown precision %s, choose from %s" % (self.precision, ", ".join(precisions)))
+        self.dx = self.L/self.N
+
+
+    @property
+    def dtype(self):
+        """The complex dtype of the chosen precision."""
+        return precisions[self.precision]
+
+
+    @property
+    def real_dtype(self):
+        """The real dtype of the chosen precision."""
+        return np.finfo(precisions[self.precision]).dtype
+
+
+    def _set_grid(self, N):
+        """Resize the spatial grid to N points inside the same box.
+        The potential scale is left untouched so that the physics does not depend on the resolution."""
+        self.N = N
+        self.dx = self.L/self.N
 
 
     def _get_constant(self):
         """Return the constant"""
-        return self.m, self.hbar, self.e, self.L, self.N, self.dx, self.dt
\ No newline at end of file
+        return self.m, self.hbar, self.e, self.L, self.N, self.dx, self.dt
+
+
+    def _get_constant_dict(self):
+        """Return the constant that can be passed on to another constant object as keywords"""
+        return {"m": self.m, "hbar": self.hbar, "e": self.e, "x0": self.x0, "L": self.L, "N": self.N, "dt": self.dt, "precision": self.precision,
+                "absorber": self.absorber, "absorber_strength": self.absorber_strength}
+
+
+    def absorbing_potential(self, x=None):
+        """Return W on x, the grid if None, where -iW is the complex absorbing potential the operators add to V.
+        W rises quadratically from 0 at the inner edge of each layer to absorber_strength at the wall, and is 0 everywhere without layers.
+        A packet entering a layer decays instead of reflecting off the wall, at the rate 2W/hbar, so an open system fits in the box.
+        Like the energies of the operators, W is in the units V has after scaling."""
+        if x is None:
+            x = np.linspace(self.x0, (self.L + self.x0), self.N)
+        if self.absorber <= 0:
+            return np.zeros(np.shape(x))
+        depth = np.maximum(np.maximum(self.x0 + self.absorber - x, x - (self.x0 + self.L - self.absorber)), 0)/self.absorber
+        return self.absorber_strength*depth**2
\ No newline at end of file
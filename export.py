@@ -0,0 +1,149 @@
+"""
+export.py
+
+Headless export of a simulation to numbered images or a video, without the real time animation.
+The physics is advanced once, recording psi every frame with a TrajectoryRecorder, and the frames are then drawn in a process pool.
+Each process restores the animation from a checkpoint, so it neither parses an expression nor builds an operator, and draws its ranges of frames
+off screen with the Agg backend, the same lines Quantum draws in the window.
+Numbered PNG frames are written to a directory, GIFs are assembled with Pillow and other videos, such as .mp4, are encoded with ffmpeg.
+
+Run this file for an export from the command line, for example
+python export.py --psi "exp(-0.5*((x-0.25)/0.05)**2)" --potential "x**2/2" --frames 600 --fpi 20 --output clip.mp4
+"""
+
+#import statements
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from collection import precisions
+from mechanics import WaveFunctionCreator, WaveFunction2D, propagators
+from recorder import TrajectoryRecorder
+
+# The name of the frame images, numbered from 0
+frame_name = "frame_%05d.png"
+
+# The state of each worker process, set up once by _init_worker
+_worker = {}
+
+
+def _init_worker(checkpoint, recording, probability, expectation_values, dpi):
+    """Set up a worker process: restore the animation from the checkpoint, open the recording and draw everything that does not move once."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from qmanimate import Quantum
+    q = Quantum.from_checkpoint(checkpoint)
+    if probability:
+        q.display_probability()
+    if expectation_values:
+        q.display_expectation_values()
+    if dpi is not None:
+        q.figure.set_dpi(dpi)
+    canvas = FigureCanvasAgg(q.figure)
+    # Animated artists are left out of a draw, so this is the background every frame is blitted onto
+    canvas.draw()
+    _worker["quantum"] = q
+    _worker["canvas"] = canvas
+    _worker["background"] = canvas.copy_from_bbox(q.figure.bbox)
+    _worker["recorder"] = TrajectoryRecorder.open(recording)
+    _worker["psi"] = WaveFunctionCreator(_worker["recorder"].frame(0), **q._get_constant_dict())
+
+
+def _render(frames):
+    """Draw the frames in the range frames and write each one as a numbered PNG to the directory frames[2]. Returns the number drawn."""
+    start, stop, directory = frames
+    q, canvas, recorder, shown = _worker["quantum"], _worker["canvas"], _worker["recorder"], _worker["psi"]
+    times = recorder.times
+    for i in range(start, stop):
+        shown.x = recorder.frame(i)
+        q._t = times[i]
+        q._update_lines(shown)
+        canvas.restore_region(_worker["background"])
+        for artist in q.lines:
+            if artist.get_animated():
+                q.ax.draw_artist(artist)
+        # A low compression level, since encoding the PNG takes longer than drawing the frame otherwise
+        Image.fromarray(np.asarray(canvas.buffer_rgba())).save(os.path.join(directory, frame_name % i), compress_level=1)
+    return stop - start
+
+
+def export(simulation, path, frames, fpi=None, fps=30, processes=None, probability=False, expectation_values=False, dpi=None):
+    """Evolve simulation for frames frames of fpi time steps each (its own fpi if None) and export them to path.
+    If path ends in .gif the frames are assembled into a GIF, if it has another extension, such as .mp4, they are encoded with ffmpeg,
+    and otherwise path is a directory the numbered PNG frames are written to.
+    probability and expectation_values choose the view as the buttons of the window do, and dpi the resolution of the frames.
+    processes is the number of worker processes drawing the frames, all cores if None. Returns the number of frames exported.
+    The simulation is left at the time of the last frame."""
+    if isinstance(simulation.psi, WaveFunction2D):
+        raise ValueError("2D runs cannot be exported yet, only 1D ones")
+    if np.ndim(simulation.psi.x) != 1:
+        raise ValueError("only a single wavefunction can be exported, not an ensemble")
+    extension = os.path.splitext(path)[1].lower()
+    video = extension not in ("", ".gif")
+    if video and shutil.which("ffmpeg") is None:
+        raise RuntimeError("ffmpeg is needed for %s videos, export to a .gif or a directory of frames instead" % extension)
+    fpi = fpi or max(simulation.fpi, 1)
+    processes = processes or os.cpu_count()
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint = os.path.join(tmp, "state.npz")
+        recording = os.path.join(tmp, "psi.dat")
+        # The physics is sequential, so it runs here first, and only the drawing is spread over the processes
+        simulation.save_checkpoint(checkpoint, operator=True)
+        recorder = TrajectoryRecorder(recording, np.shape(simulation.psi.x), fpi, simulation.dtype, capacity=frames)
+        recorder.attach(simulation)
+        simulation.run((frames - 1)*fpi)
+        recorder.close()
+        directory = os.path.join(tmp, "frames") if extension else path
+        os.makedirs(directory, exist_ok=True)
+        # A few ranges per process keep the processes busy, and contiguous ranges read the recording sequentially
+        size = max(1, -(-frames//(4*processes)))
+        ranges = [(start, min(start + size, frames), directory) for start in range(0, frames, size)]
+        with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(checkpoint, recording, probability, expectation_values, dpi)) as executor:
+            drawn = sum(executor.map(_render, ranges))
+        if extension == ".gif":
+            images = [Image.open(os.path.join(directory, frame_name % i)) for i in range(frames)]
+            images[0].save(path, save_all=True, append_images=images[1:], duration=1000/fps, loop=0)
+        elif video:
+            command = ["ffmpeg", "-y", "-loglevel", "error", "-framerate", str(fps), "-i", os.path.join(directory, frame_name),
+                       "-pix_fmt", "yuv420p", "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", path]
+            subprocess.run(command, check=True)
+    return drawn
+
+
+def main(argv=None):
+    """Export a simulation from the command line."""
+    from simulation import Simulation
+    parser = argparse.ArgumentParser(description="Headless export of a single-particle 1D quantum simulation to images or a video.")
+    parser.add_argument("--psi", default="exp(-0.5*((x-0.25)/0.05)**2)", help="initial wavefunction psi(x)")
+    parser.add_argument("--potential", default="(x)**2/2", help="potential V(x)")
+    parser.add_argument("-N", type=int, default=512, help="number of grid points")
+    parser.add_argument("--dt", type=float, default=1e-5, help="time step")
+    parser.add_argument("--method", default="crank-nicolson", choices=sorted(propagators), help="time evolution method")
+    parser.add_argument("--precision", default="single", choices=sorted(precisions), help="complex64 for throughput or complex128 for accuracy")
+    parser.add_argument("--resume", default=None, help="start from this checkpoint instead of from --psi and --potential")
+    parser.add_argument("--frames", type=int, default=300, help="number of frames")
+    parser.add_argument("--fpi", type=int, default=None, help="time steps per frame, 1 by default")
+    parser.add_argument("--fps", type=int, default=30, help="frames per second of the video")
+    parser.add_argument("--dpi", type=int, default=None, help="resolution of the frames, that of the window by default")
+    parser.add_argument("--probability", action="store_true", help="show the probability density instead of the wavefunction")
+    parser.add_argument("--expectation-values", action="store_true", help="show <x>, <p> and the energy")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes drawing the frames, all cores by default")
+    parser.add_argument("--output", default="frames", help="output video (.mp4, .webm, .gif, ...) or directory for numbered PNG frames")
+    args = parser.parse_args(argv)
+    if args.resume is not None:
+        sim = Simulation.from_checkpoint(args.resume)
+    else:
+        sim = Simulation(args.psi, args.potential, method=args.method, N=args.N, dt=args.dt, precision=args.precision)
+    try:
+        count = export(sim, args.output, args.frames, args.fpi, args.fps, args.processes, args.probability, args.expectation_values, args.dpi)
+    except (RuntimeError, ValueError) as E:
+        print(E)
+        return
+    print("Exported %d frames of %s to %s" % (count, sim.psi_name, args.output))
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
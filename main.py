@@ -12,15 +12,27 @@ It could be done through mouse clicks/drags or keyboard input of exact equations
 It also allows the user to show probability density of the particle's position along our 1D bound.
 
 Run this file by typing py main.py for windows or python3.py for mac on the terminal.
+Add --startup-report to print the import time and the time to the first frame,
+--single-thread to step the physics inside the animation instead of in a background thread,
+--timing to show how long each stage of a frame takes over the plot and save the timings to timing.json on quit,
+--absorbing to absorb a packet that reaches the walls instead of reflecting it, as if the box were open,
+and --2d for a particle in 2D, psi(x, y) in V(x, y), shown as an image of its probability density.
 """
 
 #import statements
+from time import perf_counter
+_t_start = perf_counter()
+import os
+import shutil
+import sys
+import tempfile
 import numpy as np
-from mechanics import UnitaryOperation
-from collection import constant, scales, change_array
+from collection import constant, change_array
 from matplotlib.backends import backend_tkagg
-from qmanimate import Quantum
+from qmanimate import Quantum, Quantum2D
+from timing import timers
 import tkinter as tk
+_t_imported = perf_counter()
 
 
 class wave(Quantum):
@@ -29,21 +41,32 @@ class wave(Quantum):
     It is a child class that inherits properties from the “Quantum” class of the “qmanimate” module. 
     Moreover, it uses the “WaveFunctionCreator” class and the “UnitaryOperation” class of the “mechanics” module for carrying out the quantum manipulations. """
 
-    def __init__(self):
-        """This is the Initializer for our wave function"""
+    def __init__(self, method="crank-nicolson", method_options=None, startup_report=False, threaded=True, timing=False, absorber=0.):
+        """This is the Initializer for our wave function.
+        method chooses the time evolution operator, one of "crank-nicolson", "split-operator" or "spectral".
+        If startup_report is True, the import time and the time to the first frame are printed once the animation runs.
+        If threaded is True, the time evolution runs in a background thread and the animation only draws its newest snapshot.
+        The physics then runs at 60 steps of fpi time evolutions per second, about the speed the single threaded animation had.
+        New operators are built in the background, so typing a potential or dragging its sliders does not freeze the window.
+        If timing is True, the stage timers are shown over the plot from the start, including the first operator build.
+        absorber is the width of the absorbing layers inside the walls, which take up a packet that reaches them instead of reflecting it."""
+        self.startup_times = {"imports": _t_imported - _t_start}
+        timers.enabled = timing
+        self._recording_dir = None   # The temporary directory of the recording made with the Record button
         self.window = tk.Tk()
         #closes our simulation window on the press of the window manager's close button
-        self.window.protocol('WM_DELETE_WINDOW', quit)
+        self.window.protocol('WM_DELETE_WINDOW', self.quit)
         self.window.title("Quantum Simulation")
         colour = self.window.cget('bg')
         if colour == 'SystemButtonFace': colour = "#F0F0F0"
         C = constant()
         x = np.linspace(C.x0, C.L + C.x0, C.N)
         # Default values for potential and wave function
-        V = "(x)**2/2"
+        # Both are arrays rather than expressions, so that SymPy is not loaded until an expression is typed
+        V = (x)**2/2
         psi = np.exp(-0.5*((x-0.25)/0.05)**2)
-        # Initialize the inherited animation object
-        Quantum.__init__(self, function=psi, potential=V)
+        # Initialize the inherited animation object, building the operator in the background while the window comes up
+        Quantum.__init__(self, function=psi, potential=V, method=method, method_options=method_options, defer_unitary=True, background_rebuilds=True, threaded=threaded, physics_rate=60, absorber=absorber)
         self.canvas = backend_tkagg.FigureCanvasTkAgg(self.figure,master=self.window)
         self.canvas.get_tk_widget().grid(row=0, column=0, rowspan=20, columnspan=2)
         self.canvas.get_tk_widget().bind("<B1-Motion>",self.sketch)
@@ -52,6 +75,12 @@ class wave(Quantum):
             self.figure.patch.set_facecolor(colour)
         except ValueError:
             pass
+        # Show the window with the initial wavefunction right away
+        self.canvas.draw()
+        self.window.update()
+        self.startup_times["first frame"] = perf_counter() - _t_start
+        if startup_report:
+            self.first_frame_callback = self.print_startup_report
         # Mouse menu dropdown
         self.mouse_menu_label = tk.Label(self.window,text="Mouse:")
         self.mouse_menu_label.grid(row=7,column=3,sticky=tk.W + tk.E + tk.S,padx=(10, 10),columnspan=2)
@@ -72,6 +101,16 @@ class wave(Quantum):
         b = tk.Button(self.window,text='View Probability Distribution',command=lambda:[self.display_probability(),self.change_view.config(text='View Wavefunction')] if (self._display_probs is False) else [self.display_wavefunction(),self.change_view.config(text='View ''Probability'' Distribution')])
         self.change_view = b
         self.change_view.grid(row=1, column=3, columnspan=2, padx=(10, 10))
+        # expectation values button
+        self.change_exp_val = tk.Button(self.window,text='Show Expectation Values',command=lambda:[self.display_expectation_values(),self.change_exp_val.config(text='Hide Expectation Values' if self._show_exp_val else 'Show Expectation Values')])
+        self.change_exp_val.grid(row=2, column=3, columnspan=2, padx=(10, 10))
+        # recording and playback
+        self.record_button = tk.Button(self.window,text='Record',command=self.toggle_recording)
+        self.record_button.grid(row=3, column=3, columnspan=2, padx=(10, 10))
+        self.playback_slider = tk.Scale(self.window,label="recorded time",from_=0, to=1,resolution=0.001,orient=tk.HORIZONTAL,length=200,showvalue=False,command=self.scrub_recording)
+        self.playback_slider.grid(row=4, column=3, columnspan=2, padx=(10, 10))
+        self.live_button = tk.Button(self.window,text='Live',command=self.show_live)
+        self.live_button.grid(row=5, column=3, columnspan=2, padx=(10, 10))
         # updates wavefunction button
         b2 = tk.Button(self.window, text='OK',command=self.updates_wavefunction_by_name)
         self.updates_wavefunction_button = b2
@@ -90,6 +129,8 @@ class wave(Quantum):
         self.slider_speed = None
         self.quit_button = None
         self.set_widgets_after_enter_wavefunction(init_call=True)
+        if timing:
+            self.show_timings()
         self.animation_loop()
         # Store the animation speed before a pause
         self.fpi_before_pause = None
@@ -153,13 +194,18 @@ class wave(Quantum):
             if len(params) != 0:
                 for i in range(len(params)):
                     self.slider2[i].set(params[i])
-                self.V = lambda x: self.V_base(x, *params)
-                self.V_x = scales(self.V(self.x), 15)
-                self.U_t = UnitaryOperation(self.V)
+                self.set_potential_parameters(params)
         else:
             self.set_widgets_after_enter_potential()
 
 
+    def updates_potential_by_slider(self, *event):
+        """This method updates the potential using the potential parameter sliders."""
+        params = [self.slider2[i].get() for i in range(len(self.slider2))]
+        self.set_potential_parameters(params)
+        self.updates_draw_potential()
+
+
     def set_widgets_after_enter_potential(self):
         """This method sets the widgets after the enter potential button."""
         prev_slider2_count = self.slider2_count
@@ -229,18 +275,21 @@ class wave(Quantum):
 
 
     def sketch(self, event):
-        """This method responds to mouse interaction on the canvas."""
-        if str(self.mouse_menu_string.get()) == self.mouse_menu_tuple[0]:
-            self.updates_wavefunction_by_sketch_while_paused(event)
-        elif str(self.mouse_menu_string.get()) == self.mouse_menu_tuple[1]:
-            self.updates_wavefunction_by_sketch(event)
-        elif str(self.mouse_menu_string.get()) == self.mouse_menu_tuple[2]:
-            self.updates_potential_by_sketch(event)
+        """This method responds to mouse interaction on the canvas.
+        The simulation lock is held so that the physics worker does not step psi while it is being reshaped."""
+        with self.lock:
+            if str(self.mouse_menu_string.get()) == self.mouse_menu_tuple[0]:
+                self.updates_wavefunction_by_sketch_while_paused(event)
+            elif str(self.mouse_menu_string.get()) == self.mouse_menu_tuple[1]:
+                self.updates_wavefunction_by_sketch(event)
+            elif str(self.mouse_menu_string.get()) == self.mouse_menu_tuple[2]:
+                self.updates_potential_by_sketch(event)
 
 
     def updates_wavefunction_by_name(self, *event):
         """This method updates the wavefunction given entry input."""
-        self.set_wavefunction(self.enter_function.get())
+        with self.lock:
+            self.set_wavefunction(self.enter_function.get())
         self.set_widgets_after_enter_wavefunction()
 
 
@@ -255,14 +304,17 @@ class wave(Quantum):
                     self.x, self.psi.x, x, y), normalize=False)
         else:
             if (x > self.x[self.N//4] and x < self.x[3*self.N//4]):
+                # Edit the cached momentum representation and set psi from it, instead of copying through a new wavefunction
                 if self._display_probs:
                     phases = np.angle(self.psi.p)
                     psi2_new = change_array(self.x, self.psi.p*np.conj(self.psi.p)/3, x, y)
-                    psi_new = np.sqrt(3*psi2_new)*np.exp(1.0j*phases)
-                    self.set_wavefunction(np.copy(np.fft.ifft(np.fft.ifftshift((psi_new)*(self.N/10)))), normalize=False)
+                    self.psi.p = np.sqrt(3*psi2_new)*np.exp(1.0j*phases)
                 else: 
-                    new_p = change_array(self.x, self.psi.p, x, y)
-                    self.set_wavefunction(np.copy(np.fft.ifft(np.fft.ifftshift((new_p)*(self.N/10)))), normalize=False)
+                    self.psi.p = change_array(self.x, self.psi.p, x, y)
+                # The sketch changes the norm on purpose, so it is the new norm to keep
+                self.norm_monitor.reset(self.psi)
+                self.psi_name = "wavefunction"
+                self.psi_latex = r"$\psi(x)$"
 
 
     def updates_wavefunction_by_sketch(self, event):
@@ -286,7 +338,8 @@ class wave(Quantum):
 
     def clear_wavefunction(self, *args):
         """This method sets the wavefunction to zero."""
-        self.set_wavefunction("0")
+        with self.lock:
+            self.set_wavefunction("0")
 
 
     def updates_potential_by_name(self, *event):
@@ -295,63 +348,39 @@ class wave(Quantum):
         self.potential_menu_string.set("Choose Preset Potential V(x)")
         self.previous_potential_menu_string = "Choose Preset Potential V(x)"
         no_prev_param_slider = True if len(self.V_params) == 0 else False
-        self.set_unitary(self.enter_potential.get())
+        with self.lock:
+            self.set_unitary(self.enter_potential.get())
         if not no_prev_param_slider or len(self.V_params) > 0:
             self.set_widgets_after_enter_potential()
 
 
     def updates_potential_by_sketch(self, event):
-        """This method updates the potential using the mouse."""
+        """This method updates the potential using the mouse.
+        The physics follows the sketch live: each mouse event only updates the operator at the grid points that changed, so the animation keeps running."""
         if not self._show_p:
             x, y = self.locates_mouse(event)
-            # This code block is reached right when the mouse is clicked and held down
-            if (str(event.type) == "Motion" or event.num != 1) and (self.fpi_before_pause is None):
-                # Get a scales for the y-coordinates in order for it to match up with the potential
-                if not self.potential_is_reshaped:
-                    if np.amax(self.V_x > 0):
-                        self.scales_y = np.amax(self.V_x[1:-2])/(self.bounds[-1]*0.95)
-                    elif np.amax(self.V_x < 0):
-                        self.scales_y = np.abs(np.amin(self.V_x[1:-2]))/(self.bounds[-1]*0.95)
-                    else:
-                        self.scales_y = 1.0
-                    self.potential_is_reshaped = True
-                # Set the animation speed zero
-                self.fpi_before_pause = self.fpi
-                self.fpi = 0
-                # Change the potential name to V(x)
-                self.V_name = "V(x)"
-                self.V_latex = "$V(x)$"
-            # This code block is run right after the mouse has been held down
-            elif (str(event.type) == "ButtonRelease" or event.num == 1) and (self.fpi_before_pause is not None):
-                self.U_t = UnitaryOperation(np.copy(self.V_x))
-                self.potential_menu_string.set("Choose Preset Potential V(x)")
-                tmp_str = "Choose Preset Potential V(x)"
-                self.previous_potential_menu_string = tmp_str
-                # Resume the animation speed
-                self.fpi = self.fpi_before_pause
-                self.fpi_before_pause = None
-            # This elif handles the case when mouse is clicked only once
-            elif (str(event.type) == "ButtonRelease"
-                or event.num == 1) and (self.fpi_before_pause is None):
-                # Get a scales for the y-coordinates in order for it to match up with the potential
-                if not self.potential_is_reshaped:
-                    if np.amax(self.V_x > 0):
-                        self.scales_y = np.amax(self.V_x[1:-2])/(self.bounds[-1]*0.95)
-                    elif np.amax(self.V_x < 0):
-                        self.scales_y = np.abs(np.amin(self.V_x[1:-2]))/(self.bounds[-1]*0.95)
-                    else:
-                        self.scales_y = 1.0
-                    self.potential_is_reshaped = True
-                self.V_x = change_array(self.x, self.V_x, x, y, gradual=False)
-                self.V_name = "V(x)"
-                self.V_latex = "$V(x)$"
-                self.U_t = UnitaryOperation(np.copy(self.V_x))
+            # Get a scales for the y-coordinates in order for it to match up with the potential
+            if not self.potential_is_reshaped:
+                if np.amax(self.V_x > 0):
+                    self.scales_y = np.amax(self.V_x[1:-2])/(self.bounds[-1]*0.95)
+                elif np.amax(self.V_x < 0):
+                    self.scales_y = np.abs(np.amin(self.V_x[1:-2]))/(self.bounds[-1]*0.95)
+                else:
+                    self.scales_y = 1.0
+                self.potential_is_reshaped = True
+            # Change the potential name to V(x)
+            self.V_name = "V(x)"
+            self.V_latex = "$V(x)$"
+            # Update the potential and the operator at the points under the mouse
+            y *= self.scales_y
+            V_previous = np.copy(self.V_x)
+            self.V_x = change_array(self.x, self.V_x, x, y, gradual=False)
+            self.update_potential(np.flatnonzero(self.V_x != V_previous))
+            if str(event.type) == "ButtonRelease" or event.num == 1:
                 self.potential_menu_string.set("Choose Preset Potential V(x)")
                 tmp_str = "Choose Preset Potential V(x)"
                 self.previous_potential_menu_string = tmp_str
             # Re-draw the potential
-            y *= self.scales_y
-            self.V_x = change_array(self.x, self.V_x, x, y, gradual=False)
             if np.amax(self.V_x > 0):
                 self.lines[4].set_ydata(self.V_x/self.scales_y)
             elif np.amax(self.V_x < 0):
@@ -363,6 +392,37 @@ class wave(Quantum):
     def change_animation_speed(self, event):
         """This method changes the animation speed."""
         self.fpi = self.slider_speed.get()
+        if self.fpi > 0:
+            self.fused_unitary()
+
+
+    def toggle_recording(self, *args):
+        """This method starts recording the wavefunction to a temporary file, or stops recording."""
+        if self.recorder is not None and self.recorder.simulation is not None:
+            self.stop_recording()
+            self.record_button.config(text='Record')
+        else:
+            self.discard_recording()
+            self._recording_dir = tempfile.mkdtemp()
+            self.start_recording(os.path.join(self._recording_dir, "trajectory"))
+            self.record_button.config(text='Stop Recording')
+
+
+    def discard_recording(self):
+        """This method deletes the last recording, which can be played back until then, and the temporary directory it was written to."""
+        if self.recorder is not None:
+            self.stop_recording()
+            self.recorder.remove()
+        if self._recording_dir is not None:
+            shutil.rmtree(self._recording_dir, ignore_errors=True)
+            self._recording_dir = None
+
+
+    def scrub_recording(self, *args):
+        """This method shows the recorded wavefunction at the time chosen with the playback slider."""
+        if self.recorder is not None and len(self.recorder) > 0:
+            times = self.recorder.times
+            self.show_recorded(times[0] + self.playback_slider.get()*(times[-1] - times[0]))
 
 
     def locates_mouse(self, event):
@@ -380,11 +440,93 @@ class wave(Quantum):
         return x, y
 
 
+    def print_startup_report(self):
+        """This method prints how long the imports and the first frames took, measured from the start of this module."""
+        self.startup_times["first animated frame"] = perf_counter() - _t_start
+        if self.unitary_build_time is not None:
+            self.startup_times["operator build (background)"] = self.unitary_build_time
+        print("Startup report (seconds)")
+        for name, seconds in self.startup_times.items():
+            print("  %-30s %.3f" % (name, seconds))
+        print("  SymPy loaded: %s" % ("sympy" in sys.modules))
+
+
+    def quit(self, *event):
+        """This method quits the application."""
+        self.stop_worker()
+        self.discard_recording()
+        if timers.enabled:
+            timers.export("timing.json")
+            print("Saved the stage timings to timing.json")
+        self.window.quit()
+
+
+class wave2d(Quantum2D):
+    """This class is the Tkinter GUI of the 2D mode, a particle in 2D drawn as an image of its probability density.
+    It is a child class of the “Quantum2D” class of the “qmanimate” module, and takes psi(x, y) and V(x, y) as expressions of x and y."""
+
+    def __init__(self, threaded=True, timing=False, **constants):
+        """This is the Initializer for the 2D wave function. constants override the defaults, the grid is 256 by 256 unless N is given."""
+        self.window = tk.Tk()
+        self.window.protocol('WM_DELETE_WINDOW', self.quit)
+        self.window.title("Quantum Simulation 2D")
+        timers.enabled = timing
+        Quantum2D.__init__(self, threaded=threaded, physics_rate=60, **constants)
+        self.canvas = backend_tkagg.FigureCanvasTkAgg(self.figure,master=self.window)
+        self.canvas.get_tk_widget().grid(row=0, column=0, rowspan=10, columnspan=2)
+        # Wavefunction entry field
+        tk.Label(self.window,text="Enter Wavefunction \u03C8(x, y)").grid(row=0, column=3,sticky=tk.W + tk.E + tk.S,padx=(10, 10))
+        self.enter_function = tk.Entry(self.window)
+        self.enter_function.bind("<Return>",self.updates_wavefunction_by_name)
+        self.enter_function.grid(row=1, column=3,sticky=tk.W + tk.E + tk.N + tk.S,padx=(11, 11))
+        tk.Button(self.window,text='OK',command=self.updates_wavefunction_by_name).grid(row=2, column=3,sticky=tk.N + tk.W + tk.E,padx=(10, 10))
+        # Potential entry field
+        tk.Label(self.window,text="Enter Potential V(x, y)").grid(row=3, column=3,sticky=tk.W + tk.E + tk.S,padx=(10, 10))
+        self.enter_potential = tk.Entry(self.window)
+        self.enter_potential.bind("<Return>",self.updates_potential_by_name)
+        self.enter_potential.grid(row=4, column=3,sticky=tk.W + tk.E + tk.N + tk.S,padx=(11, 11))
+        tk.Button(self.window,text='OK',command=self.updates_potential_by_name).grid(row=5, column=3,sticky=tk.N + tk.W + tk.E,padx=(10, 10))
+        # Animation speed slider
+        self.slider_speed_label = tk.LabelFrame(self.window, text="Animation Speed")
+        self.slider_speed_label.grid(row=6,column=3, padx=(10, 10))
+        self.slider_speed = tk.Scale(self.slider_speed_label,from_=0, to=10,orient=tk.HORIZONTAL,length=200,command=self.change_animation_speed)
+        self.slider_speed.grid(row=7,column=3, padx=(10, 10))
+        self.slider_speed.set(1)
+        tk.Button(self.window, text='QUIT', command=self.quit).grid(row=8, column=3)
+        self.animation_loop()
+
+
+    def updates_wavefunction_by_name(self, *event):
+        """This method updates the wavefunction given entry input."""
+        with self.lock:
+            self.set_wavefunction(self.enter_function.get())
+
+
+    def updates_potential_by_name(self, *event):
+        """This method updates the potential using the potential entry input, and redraws its contour lines."""
+        with self.lock:
+            self.set_unitary(self.enter_potential.get())
+        self.canvas.draw()
+
+
+    def change_animation_speed(self, event):
+        """This method changes the animation speed."""
+        self.fpi = self.slider_speed.get()
+
+
     def quit(self, *event):
         """This method quits the application."""
+        self.stop_worker()
+        if timers.enabled:
+            timers.export("timing.json")
+            print("Saved the stage timings to timing.json")
         self.window.quit()
 
 
 if __name__ == "__main__":
-    run = wave()
+    if "--2d" in sys.argv:
+        run = wave2d(threaded="--single-thread" not in sys.argv, timing="--timing" in sys.argv)
+    else:
+        run = wave(startup_report="--startup-report" in sys.argv, threaded="--single-thread" not in sys.argv, timing="--timing" in sys.argv,
+                   absorber=0.1 if "--absorbing" in sys.argv else 0.)
     tk.mainloop()
\ No newline at end of file
@@ -6,48 +6,163 @@ Final Project
 mechanics.py
 
 Single-Particle 1D Quantum Mechanics module.
-It constitutes of two classes: WaveFunctionCreator and UnitaryOperation.
+It constitutes of the classes WaveFunctionCreator, WaveFunctionEnsemble, UnitaryOperation, SplitOperator and SpectralOperation.
 WaveFunctionCreator sets up and normalizes the wave. 
 It uses Fourier transform to decompose our wave function into real and imaginary constituents.
+WaveFunctionEnsemble holds many wavefunctions in one array so that they evolve together.
 UnitaryOperation helps us evolve time for our simulation and manipulates the potential.
+SplitOperator is an alternative split-step Fourier time evolution for smooth potentials.
+SpectralOperation evolves in the eigenbasis of the Hamiltonian, so it can jump to any time without stepping.
+TimeDependentOperation evolves psi in a potential V(x, t) that changes with time, reusing the kinetic part of Crank-Nicolson every step.
+RepeatedOperation applies several time steps per call, see UnitaryOperation.power.
+AdaptiveOperation is Crank-Nicolson with a time step that adapts to the error of each step.
+WaveFunction2D and ADIOperation are the wavefunction and the alternating direction implicit Crank-Nicolson operator of the 2D mode.
+NormMonitor watches the norm of the wavefunction for drift caused by rounding.
+PropagatorCache keeps recently built operators so that returning to a potential does not rebuild it.
 
 This module is only a collection of classes, so there is no point in running it.
 """
 
 #import statements
+import threading
 import numpy as np
-from collection import constant
+from collections import OrderedDict
+from copy import copy
+from hashlib import sha1
+from collection import constant, noise, evaluate
+from timing import timers
+
+# np.trapz was renamed to np.trapezoid in NumPy 2.0
+trapezoid = np.trapezoid if hasattr(np, "trapezoid") else np.trapz
+
+
+def along_grid(a, psi):
+    """Reshape the grid array a so that it broadcasts against psi, which is either one state (N,) or an ensemble (N, M)."""
+    return a.reshape(a.shape + (1,)*(np.ndim(psi) - 1))
 
 
 class WaveFunctionCreator(constant):
     """This is the Wavefunction class in 1D.
     The wave function is essentially represented in the form of Dirac Notation (Bra-Ket) through integration and complex conjugation using the NumPy library. """
     
-    def __init__(self, waveform):
-        super().__init__()
+    def __init__(self, waveform, **constants):
+        super().__init__(**constants)
+        # Buffers of the momentum representation, allocated on the first read of p
+        self._p = None
+        self._p_fft = None
+        self._p_valid = False
         if callable(waveform):
-            try:
-                self.x = waveform(np.linspace(self.x0,(self.L + self.x0),self.N))
-            except:
-                tmpx = np.linspace(self.x0, (self.L + self.x0), self.N)
-                self.x = np.array([waveform(x) for x in tmpx])
-            try:
-                len(self.x)
-            except TypeError as E:
-                print(E)
+            self.x = evaluate(waveform, np.linspace(self.x0,(self.L + self.x0),self.N))
         elif isinstance(waveform, np.ndarray):
             self.x = waveform
 
 
+    @property
+    def x(self):
+        """The wavefunction in position space. Assigning to it invalidates the cached momentum representation."""
+        return self._x
+
+
+    @x.setter
+    def x(self, psi):
+        # Kept in the chosen precision, which is a no-op when it already is
+        self._x = np.asarray(psi, self.dtype)
+        self._p_valid = False
+
+
+    @property
+    def p(self):
+        """The wavefunction in momentum space, the shifted FFT of x.
+        It is only computed when read, into preallocated buffers, and cached until x is assigned again.
+        The returned array is that buffer, so copy it to keep it past the next change of x."""
+        if not self._p_valid:
+            if self._p is None or self._p.shape != np.shape(self._x) or self._p.dtype != self.dtype:
+                self._p = np.empty(np.shape(self._x), self.dtype)
+                self._p_fft = np.empty(np.shape(self._x), self.dtype)
+            with timers.stage("fft"):
+                try:
+                    np.fft.fft(self._x, axis=0, out=self._p_fft)
+                except TypeError:
+                    # NumPy before 2.0 has no out argument
+                    self._p_fft[...] = np.fft.fft(self._x, axis=0)
+                # fftshift, written into the buffer instead of a new array
+                n = len(self._p)
+                self._p[:n//2] = self._p_fft[(n+1)//2:]
+                self._p[n//2:] = self._p_fft[:(n+1)//2]
+                self._p /= self.N/10
+            self._p_valid = True
+        return self._p
+
+
+    @p.setter
+    def p(self, psi_p):
+        """Set the wavefunction from its momentum representation. The given p is kept as the cached momentum representation."""
+        self.x = np.fft.ifft(np.fft.ifftshift(psi_p, axes=0)*(self.N/10), axis=0)
+        if self._p is None or self._p.shape != np.shape(psi_p) or self._p.dtype != self.dtype:
+            self._p = np.empty(np.shape(psi_p), self.dtype)
+        if psi_p is not self._p:
+            self._p[...] = psi_p
+        self._p_valid = True
+
+
+    def norm(self):
+        """Return the integral of |psi|^2, one for each state of an ensemble."""
+        return trapezoid(np.real(np.conj(self.x)*self.x), dx=self.dx, axis=0)
+
+
     def normalize(self):
         """Normalize the wavefunction through integration and complex conjugation"""
         try:
             #Sets up the equation, using Fourier transform
-            self.x = self.x/np.sqrt(np.trapz(np.conj(self.x)*self.x, dx=self.dx))
+            self.x = self.x/np.sqrt(self.norm())
         except FloatingPointError as E:
             print(E)
 
 
+class WaveFunctionEnsemble(WaveFunctionCreator):
+    """M wavefunctions stored as the columns of one contiguous (N, M) array.
+    Every time evolution operator accepts the whole block, so the ensemble evolves with one batched solve or matrix product per step instead of M separate ones."""
+
+    def __init__(self, waveforms, **constants):
+        """Initialize the ensemble from a list of waveforms, each a callable or an array like WaveFunctionCreator takes."""
+        constant.__init__(self, **constants)
+        self._p = None
+        self._p_fft = None
+        columns = [WaveFunctionCreator(waveform, **constants).x for waveform in waveforms]
+        if len(columns[0]) != self.N:
+            self._set_grid(len(columns[0]))
+        # Fortran order keeps each state contiguous, which is the layout LAPACK and the FFTs work on
+        self.x = np.asfortranarray(np.stack(columns, axis=1), self.dtype)
+
+
+    @classmethod
+    def from_noise(cls, waveform, M, amplitude=0.1, **constants):
+        """Make an ensemble of M copies of waveform, each perturbed by a different noise of the given amplitude."""
+        psi = WaveFunctionCreator(waveform, **constants).x
+        return cls([psi + amplitude*noise(psi) for _ in range(M)], **constants)
+
+
+    @classmethod
+    def from_parameters(cls, function, values, **constants):
+        """Make an ensemble from a Function and a list of parameter tuples, one state for each tuple."""
+        return cls([lambda x, v=v: function(x, *v) for v in values], **constants)
+
+
+    def __len__(self):
+        """The number of states in the ensemble."""
+        return self.x.shape[1]
+
+
+    def __getitem__(self, i):
+        """Return the i-th state as its own wavefunction."""
+        return WaveFunctionCreator(np.copy(self.x[:, i]), **self._get_constant_dict())
+
+
+    def density(self):
+        """Return the ensemble averaged probability density."""
+        return np.mean(np.real(np.conj(self.x)*self.x), axis=1)
+
+
 class UnitaryOperation(constant):
     """A unitary operator that dictates time evolution of the wavefunction.
     Unitary time evolution is the specific type of time evolution where probability is conserved. 
@@ -55,20 +170,14 @@ class UnitaryOperation(constant):
     Physically, it means that the probability of the existence of the quantum system does not change with time. 
     The quantum system exists at t=0 with probability=1, and also at t=T with probability=1."""
 
-    def __init__(self, Potential):
-        """Initialize the unitary operator."""
-        super().__init__()
-        if isinstance(Potential, np.ndarray):
-            V = Potential
-        elif callable(Potential):
-            x = np.linspace(self.x0, (self.L + self.x0), self.N)
-            V = np.array([Potential(xi) for xi in x])
-        V *= self._scales
+    def __init__(self, Potential, **constants):
+        """Initialize the unitary operator.
+        Crank-Nicolson gives A psi(t + dt) = B psi(t) with tridiagonal A and B, so only their three diagonals are stored.
+        A is factored once with LAPACK (gttrf) and every step is a banded solve (gttrs), which is O(N) in both memory and time."""
+        super().__init__(**constants)
+        V = self._sample_potential(Potential)
         # Get constant
         m, hbar, e, L, N, dx, dt = self._get_constant()
-        # Initialize A and B matrices
-        A = np.zeros([N, N], np.complex64)
-        B = np.zeros([N, N], np.complex64)
         K = (dt*1.0j*hbar)/(4*m*dx**2)
         J = (dt*1.0j)/(2*hbar)
         # Initialize the constant, nonzero elements of the A and B matrices
@@ -76,26 +185,705 @@ class UnitaryOperation(constant):
         a2 = -K
         b1 = 1 - 2*K
         b2 = K
-        # Construct the A and B matrices
-        for i in range(N-1):
-            A[i][i] = a1 + J*V[i]
-            B[i][i] = b1 - J*V[i]
-            A[i][i+1] = a2
-            A[i+1][i] = a2
-            B[i][i+1] = b2
-            B[i+1][i] = b2
-        A[N-1][N-1] = a1 + J*V[N-1]
-        B[N-1][N-1] = b1 - J*V[N-1]
-        # Obtain U
-        self.U = np.dot(np.linalg.inv(A), B)
-        # The identity operator is what the unitary matrix reduces to at time zero. 
-        self.id = np.identity(len(self.U[0]), np.complex)
+        # The diagonals of A and B. The off diagonals are constant, so B only needs its main diagonal and b2.
+        self.A_diag = (a1 + J*V).astype(self.dtype)
+        self.A_off = a2*np.ones([N-1], self.dtype)
+        self.B_diag = (b1 - J*V).astype(self.dtype)
+        self.b2 = self.dtype(b2)
+        # Kept for updating the potential terms later
+        self._a1, self._b1, self._J = a1, b1, J
+        self._factor()
+
+
+    def _sample_potential(self, Potential):
+        """Return the scaled potential on the grid. An array sets the grid size, a callable is evaluated on the current grid.
+        With absorbing layers the potential is complex, -iW is added inside them, see constant.absorbing_potential."""
+        if isinstance(Potential, np.ndarray):
+            V = Potential
+            if len(V) != self.N:
+                self._set_grid(len(V))
+        elif callable(Potential):
+            V = evaluate(Potential, np.linspace(self.x0, (self.L + self.x0), self.N))
+        if self.absorber > 0:
+            return V*self._scales - 1j*self.absorbing_potential()
+        return V*self._scales
+
+
+    def _factor(self):
+        """LU factor the tridiagonal matrix A once, so each time step is only a banded solve."""
+        # SciPy is imported here rather than at the top, so that it loads while the operator is built and not at startup
+        from scipy.linalg import get_lapack_funcs
+        self._gttrf, self._gttrs = get_lapack_funcs(("gttrf", "gttrs"), (self.A_diag,))
+        dl, d, du, du2, ipiv, info = self._gttrf(self.A_off, self.A_diag, self.A_off)
+        if info != 0:
+            raise np.linalg.LinAlgError("A is singular at row %d" % info)
+        self._lu = (dl, d, du, du2, ipiv)
+
+
+    def __getstate__(self):
+        """Return the attributes of the operator without the LAPACK routines, which cannot be saved. The LU factors are kept."""
+        state = dict(vars(self))
+        state.pop("_gttrf", None)
+        state.pop("_gttrs", None)
+        return state
+
+
+    def __setstate__(self, state):
+        """Restore the attributes of the operator. The LAPACK routines are looked up again, but A is not factored again."""
+        self.__dict__.update(state)
+        if "_lu" in state:
+            from scipy.linalg import get_lapack_funcs
+            self._gttrf, self._gttrs = get_lapack_funcs(("gttrf", "gttrs"), (self.A_diag,))
+
+
+    def update_potential(self, indices, V):
+        """Change the potential at the grid points indices to V, without rebuilding the operator.
+        Only the potential terms on the diagonals of A and B change. Refactoring a tridiagonal matrix is O(N) and takes microseconds,
+        so A is simply factored again. The diagonals are replaced rather than written into, so shallow copies of this operator are unaffected.
+        Returns True, meaning the operator was updated."""
+        V = np.asarray(V)*self._scales
+        if self.absorber > 0:
+            V = V - 1j*self.absorbing_potential()[indices]
+        self.A_diag = np.copy(self.A_diag)
+        self.A_diag[indices] = self._a1 + self._J*V
+        self.B_diag = np.copy(self.B_diag)
+        self.B_diag[indices] = self._b1 - self._J*V
+        self._factor()
+        return True
+
+
+    def _apply_B(self, psi, out=None):
+        """Multiply psi by the tridiagonal matrix B without forming it, into out if it is given."""
+        Bpsi = np.multiply(along_grid(self.B_diag, psi), psi, out=out)
+        Bpsi[1:] += self.b2*psi[:-1]
+        Bpsi[:-1] += self.b2*psi[1:]
+        return Bpsi
+
+
+    def solve(self, psi, out):
+        """Write one time step of the array psi into out, an array of the dtype of the operator other than psi, and return it.
+        Unlike calling the operator, this allocates no wavefunction, which matters to callers that take many trial steps."""
+        out, info = self._gttrs(*self._lu, self._apply_B(psi, out), overwrite_b=True)
+        return out
+
+
+    def power(self, n):
+        """Return an operator that applies n time steps in one call.
+        The product of n banded steps is a dense matrix, and applying it costs more than n banded solves on every grid size we measured,
+        so the steps are kept banded and only run back to back."""
+        if n == 1:
+            return self
+        return RepeatedOperation(self, n)
+
+
+    def __call__(self, wavefunction):
+        """Call this class on a wavefunction to time evolve it."""
+        try:
+            #solves A psi(t + dt) = B psi(t) with the stored LU factors of A
+            psi, info = self._gttrs(*self._lu, self._apply_B(wavefunction.x))
+            wavefunction.x = psi
+        except FloatingPointError:
+            pass
+
+
+class SplitOperator(UnitaryOperation):
+    """A split-step Fourier time evolution operator.
+    Each step applies half of the potential phase in position space, the full kinetic phase in momentum space, and the other half of the potential phase (Strang splitting).
+    Both phase arrays are computed once per potential and dt, so a step costs two FFTs and no matrix at all.
+    The FFT makes the box periodic instead of a hard wall, so it is best suited to smooth potentials and packets that stay away from the edges."""
+
+    def __init__(self, Potential, **constants):
+        """Initialize the potential and kinetic phase arrays."""
+        constant.__init__(self, **constants)
+        V = self._sample_potential(Potential)
+        # Get constant
+        m, hbar, e, L, N, dx, dt = self._get_constant()
+        k = 2.0*np.pi*np.fft.fftfreq(N, d=dx)
+        self.V_phase = np.exp(-0.5j*V*dt/hbar).astype(self.dtype)
+        self.T_phase = np.exp(-0.5j*hbar*k**2*dt/m).astype(self.dtype)
+        self.V_phase2 = self.V_phase**2
+        # Number of steps applied per call
+        self.steps = 1
+
+
+    def update_potential(self, indices, V):
+        """Change the potential at the grid points indices to V by recomputing only those potential phases.
+        The phase arrays are replaced rather than written into, so shallow copies of this operator are unaffected."""
+        V = np.asarray(V)*self._scales
+        if self.absorber > 0:
+            V = V - 1j*self.absorbing_potential()[indices]
+        self.V_phase = np.copy(self.V_phase)
+        self.V_phase[indices] = np.exp(-0.5j*V*self.dt/self.hbar)
+        self.V_phase2 = self.V_phase**2
+        return True
+
+
+    def power(self, n):
+        """Return an operator that applies n time steps in one call.
+        The closing half potential step of each step is merged with the opening half step of the next, so n steps need n+1 potential phases instead of 2n."""
+        fused = copy(self)
+        fused.steps = n
+        return fused
+
+
+    def __call__(self, wavefunction):
+        """Call this class on a wavefunction to time evolve it."""
+        try:
+            V_phase, V_phase2, T_phase = (along_grid(a, wavefunction.x) for a in (self.V_phase, self.V_phase2, self.T_phase))
+            psi = V_phase*wavefunction.x
+            for _ in range(self.steps - 1):
+                psi = V_phase2*np.fft.ifft(T_phase*np.fft.fft(psi, axis=0), axis=0)
+            wavefunction.x = V_phase*np.fft.ifft(T_phase*np.fft.fft(psi, axis=0), axis=0)
+        except FloatingPointError:
+            pass
+
+
+class SpectralOperation(UnitaryOperation):
+    """A time evolution operator in the eigenbasis of the discretized Hamiltonian.
+    H is built from the same kinetic and potential terms as UnitaryOperation and diagonalized once per potential.
+    Evolving by any time t is then a projection onto the eigenstates and a phase, so seeking costs the same as a single step.
+    Keeping only the lowest modes makes large grids cheap, at the cost of dropping the high energy part of psi."""
+
+    def __init__(self, Potential, modes=None, **constants):
+        """Diagonalize the Hamiltonian. modes is the number of lowest eigenstates kept, all of them if None."""
+        from scipy.linalg import eigh_tridiagonal
+        constant.__init__(self, **constants)
+        if self.absorber > 0:
+            raise ValueError("absorbing layers make the Hamiltonian non Hermitian, use crank-nicolson or split-operator with them")
+        V = self._sample_potential(Potential)
+        # Get constant
+        m, hbar, e, L, N, dx, dt = self._get_constant()
+        # The tridiagonal Hamiltonian that A = 1 + (i dt/2 hbar) H and B = 1 - (i dt/2 hbar) H are made of
+        H_diag = hbar**2/(m*dx**2) + V
+        H_off = -hbar**2/(2*m*dx**2)*np.ones([N-1])
+        if modes is None or modes >= N:
+            self.E, self.phi = eigh_tridiagonal(H_diag, H_off)
+        else:
+            self.E, self.phi = eigh_tridiagonal(H_diag, H_off, select="i", select_range=(0, modes - 1))
+        # The energies stay in double precision so that the phases are accurate even for long jumps in time
+        self.phi = self.phi.astype(self.real_dtype)
+        self.modes = len(self.E)
+        self.phase = self.phases(dt)
+
+
+    def update_potential(self, indices, V):
+        """A local change of the potential changes every eigenstate, so the spectral operator cannot be updated.
+        Returns False, meaning the operator has to be rebuilt."""
+        return False
+
+
+    def phases(self, t):
+        """Return the phase each eigenstate picks up after a time t."""
+        return np.exp(-1.0j*self.E*t/self.hbar).astype(self.dtype)
+
+
+    def _real_matmul(self, M, psi):
+        """Multiply the complex psi by the real matrix M as one real matrix product, without converting M to complex."""
+        psi = np.ascontiguousarray(psi, self.dtype)
+        out = M @ psi.view(self.real_dtype).reshape(psi.shape[0], -1)
+        return np.ascontiguousarray(out).view(self.dtype).reshape((M.shape[0],) + psi.shape[1:])
+
+
+    def project(self, psi):
+        """Return the coefficients of psi in the eigenbasis."""
+        return self._real_matmul(self.phi.T, psi)
+
+
+    def evolve(self, wavefunction, t):
+        """Jump the wavefunction forward (or backward) by a time t with a single projection."""
+        coefficients = self.project(wavefunction.x)
+        wavefunction.x = self._real_matmul(self.phi, along_grid(self.phases(t), coefficients)*coefficients)
+
+
+    def power(self, n):
+        """Return an operator that applies n time steps in one call, at the cost of one step."""
+        fused = copy(self)
+        fused.phase = self.phases(n*self.dt)
+        return fused
+
+
+    def __call__(self, wavefunction):
+        """Call this class on a wavefunction to time evolve it."""
+        try:
+            coefficients = self.project(wavefunction.x)
+            wavefunction.x = self._real_matmul(self.phi, along_grid(self.phase, coefficients)*coefficients)
+        except FloatingPointError:
+            pass
+
+
+class TimeDependentOperation(UnitaryOperation):
+    """Time evolution in a time dependent potential V(x, t), such as a driven field x*cos(w*t).
+    Each step applies half of the potential phase, a Crank-Nicolson step of the kinetic term alone and the other half of the potential phase (Strang splitting).
+    The kinetic matrix does not depend on V, so A is factored once and reused by every step, and only the potential phase is refreshed,
+    with the potential at the middle of the step, which keeps the scheme second order. A driven step then costs an O(N) phase on top of a static one.
+    t is the time of the wavefunction the next step starts from, and every step advances it by dt."""
+
+    def __init__(self, Potential, t=0., **constants):
+        """Initialize the operator. Potential is a function of x and t."""
+        constant.__init__(self, **constants)
+        # The Crank-Nicolson operator of the kinetic term, and of the absorbing layers if there are any, which is factored here once
+        UnitaryOperation.__init__(self, np.zeros([self.N]), **constants)
+        self.Potential = Potential
+        self.t = t
+        self._grid = np.linspace(self.x0, (self.L + self.x0), self.N)
+        self._refreshed_at = None
+        self._refresh(t + self.dt/2)
+
+
+    def _refresh(self, t):
+        """Set the half step potential phase to the one of the potential at the time t, unless it already is."""
+        if t == self._refreshed_at:
+            return
+        V = self.Potential(self._grid, t)
+        if np.shape(V) != np.shape(self._grid):
+            V = evaluate(lambda x: self.Potential(x, t), self._grid)
+        # cos and sin in the precision of psi take a third of the time of a complex exp
+        angle = (-0.5*self._scales*self.dt/self.hbar*np.real(V)).astype(self.real_dtype)
+        self.V_phase = np.empty(angle.shape, self.dtype)
+        self.V_phase.real = np.cos(angle)
+        self.V_phase.imag = np.sin(angle)
+        self._refreshed_at = t
+
+
+    def update_potential(self, indices, V):
+        """The potential is a function of time, so a local edit cannot be applied to it. Returns False."""
+        return False
+
+
+    def __call__(self, wavefunction):
+        """Call this class on a wavefunction to time evolve it from t to t + dt."""
+        self._refresh(self.t + self.dt/2)
+        try:
+            V_phase = along_grid(self.V_phase, wavefunction.x)
+            psi, info = self._gttrs(*self._lu, self._apply_B(V_phase*wavefunction.x))
+            wavefunction.x = V_phase*psi
+        except FloatingPointError:
+            pass
+        self.t += self.dt
+
+
+class WaveFunction2D(WaveFunctionCreator):
+    """A wavefunction psi(x, y) on an N by N grid of the same box in x and y, stored as an (N, N) array indexed [y, x] like an image."""
+
+    def __init__(self, waveform, **constants):
+        """Initialize the wavefunction from an (N, N) array or a callable of x and y."""
+        constant.__init__(self, **constants)
+        self._p = None
+        self._p_fft = None
+        self._p_valid = False
+        if callable(waveform):
+            x = np.linspace(self.x0, (self.L + self.x0), self.N)
+            X, Y = np.meshgrid(x, x)
+            self.x = np.array(np.broadcast_to(waveform(X, Y), X.shape))
+        elif isinstance(waveform, np.ndarray):
+            if len(waveform) != self.N:
+                self._set_grid(len(waveform))
+            self.x = waveform
+
+
+    @property
+    def p(self):
+        """The wavefunction in momentum space, the shifted 2D FFT of x, computed when read and cached until x is assigned again."""
+        if not self._p_valid:
+            with timers.stage("fft"):
+                self._p = np.asarray(np.fft.fftshift(np.fft.fft2(self._x))/(self.N/10)**2, self.dtype)
+            self._p_valid = True
+        return self._p
+
+
+    @p.setter
+    def p(self, psi_p):
+        """Set the wavefunction from its momentum representation."""
+        self.x = np.fft.ifft2(np.fft.ifftshift(psi_p)*(self.N/10)**2)
+
+
+    def norm(self):
+        """Return the integral of |psi|^2 over the plane."""
+        return trapezoid(trapezoid(np.real(np.conj(self.x)*self.x), dx=self.dx, axis=1), dx=self.dx, axis=0)
+
+
+    def density(self):
+        """Return the probability density |psi|^2."""
+        return np.real(np.conj(self.x)*self.x)
+
+
+class ADIOperation(constant):
+    """Crank-Nicolson time evolution in 2D by alternating direction implicit (Peaceman-Rachford) steps.
+    The Hamiltonian is split into Hx, the kinetic energy along x with half the potential, and Hy, the same along y.
+    A step is the half step (1 + i dt Hx/2hbar) psi' = (1 - i dt Hy/2hbar) psi followed by (1 + i dt Hy/2hbar) psi(t + dt) = (1 - i dt Hx/2hbar) psi'.
+    Each implicit half step is N independent tridiagonal systems, one per line of the grid. Laid out one line after the other they form a
+    single tridiagonal system of N^2 unknowns whose off diagonals are zero between lines, so both are factored once with LAPACK (gttrf)
+    and every half step is one banded solve (gttrs). Memory and time per step are O(N^2), where the full operator would have N^4 entries."""
+
+    def __init__(self, Potential, **constants):
+        """Initialize the operator for the potential, an (N, N) array indexed [y, x]."""
+        super().__init__(**constants)
+        V = np.asarray(Potential)
+        if len(V) != self.N:
+            self._set_grid(len(V))
+        V = V*self._scales
+        if self.absorber > 0:
+            # Layers along all four walls, which overlap in the corners
+            W = self.absorbing_potential()
+            V = V - 1j*(W[:, None] + W[None, :])
+        m, hbar, e, L, N, dx, dt = self._get_constant()
+        K = (dt*1.0j*hbar)/(4*m*dx**2)
+        J = (dt*1.0j)/(2*hbar)
+        # The explicit halves only need the main diagonal of B, shared by both directions, and the constant off diagonal b2
+        self.B_diag = (1 - 2*K - J*V/2).astype(self.dtype)
+        self.b2 = self.dtype(K)
+        A_diag = 1 + 2*K + J*V/2
+        # The off diagonal entries that would couple the end of one line to the start of the next are zero
+        self.A_off = -K*np.ones([N*N - 1], self.dtype)
+        self.A_off[N-1::N] = 0
+        # Along x psi is raveled row by row, along y it is raveled after a transpose
+        self.Ax_diag = A_diag.ravel().astype(self.dtype)
+        self.Ay_diag = A_diag.T.ravel().astype(self.dtype)
+        self._factor()
+
+
+    def _factor(self):
+        """LU factor the tridiagonal matrices of both implicit half steps."""
+        from scipy.linalg import get_lapack_funcs
+        self._gttrf, self._gttrs = get_lapack_funcs(("gttrf", "gttrs"), (self.Ax_diag,))
+        factors = []
+        for diag in (self.Ax_diag, self.Ay_diag):
+            dl, d, du, du2, ipiv, info = self._gttrf(self.A_off, diag, self.A_off)
+            if info != 0:
+                raise np.linalg.LinAlgError("A is singular at row %d" % info)
+            factors.append((dl, d, du, du2, ipiv))
+        self._lu_x, self._lu_y = factors
+
+
+    def __getstate__(self):
+        """Return the attributes of the operator without the LAPACK routines, which cannot be saved. The LU factors are kept."""
+        state = dict(vars(self))
+        state.pop("_gttrf", None)
+        state.pop("_gttrs", None)
+        return state
+
+
+    def __setstate__(self, state):
+        """Restore the attributes of the operator. The LAPACK routines are looked up again, but nothing is factored again."""
+        self.__dict__.update(state)
+        from scipy.linalg import get_lapack_funcs
+        self._gttrf, self._gttrs = get_lapack_funcs(("gttrf", "gttrs"), (self.Ax_diag,))
+
+
+    def update_potential(self, indices, V):
+        """A local change of the potential is not applied in place, so this returns False and the operator is rebuilt."""
+        return False
+
+
+    def power(self, n):
+        """Return an operator that applies n time steps in one call."""
+        if n == 1:
+            return self
+        return RepeatedOperation(self, n)
 
 
     def __call__(self, wavefunction):
         """Call this class on a wavefunction to time evolve it."""
         try:
-            #returns the matrix multiplication of the two
-            wavefunction.x = np.matmul(self.U, wavefunction.x)
+            psi = wavefunction.x
+            N = len(psi)
+            # (1 - i dt Hy/2hbar) psi, then the implicit solve along x
+            rhs = self.B_diag*psi
+            rhs[1:] += self.b2*psi[:-1]
+            rhs[:-1] += self.b2*psi[1:]
+            psi, info = self._gttrs(*self._lu_x, rhs.ravel())
+            psi = psi.reshape(N, N)
+            # (1 - i dt Hx/2hbar) psi', then the implicit solve along y
+            rhs = self.B_diag*psi
+            rhs[:, 1:] += self.b2*psi[:, :-1]
+            rhs[:, :-1] += self.b2*psi[:, 1:]
+            psi, info = self._gttrs(*self._lu_y, rhs.T.ravel())
+            wavefunction.x = np.ascontiguousarray(psi.reshape(N, N).T)
         except FloatingPointError:
-            pass
\ No newline at end of file
+            pass
+
+
+class RepeatedOperation(constant):
+    """n time steps of an operator applied in one call, for operators whose fused form would be more expensive than the steps themselves."""
+
+    def __init__(self, operator, n):
+        """Initialize with the single step operator."""
+        super().__init__()
+        self.operator = operator
+        self.steps = n
+
+
+    def __call__(self, wavefunction):
+        """Call this class on a wavefunction to time evolve it by all n steps."""
+        for _ in range(self.steps):
+            self.operator(wavefunction)
+
+
+class AdaptiveOperation(constant):
+    """Fourth order time evolution with an adaptive time step, made of Crank-Nicolson steps.
+    Crank-Nicolson is symmetric in time, so three of its steps of g1*h, g2*h and g1*h, with g1 = 1/(2 - 2^(1/3)) and g2 = 1 - 2*g1
+    (a backward step), form a symmetric fourth order step of h (the triple jump of Yoshida). Each of them is unitary, so their product is too.
+    The local error is estimated by comparing that step with a single second order Crank-Nicolson step of h, which costs one more solve.
+    The difference is the error of the second order step and bounds the error of the fourth order step that is kept from above.
+    The step is halved until the estimate is within tolerance and doubled again once it is well below it.
+    An accepted step costs four solves, so it pays off once it is longer than four steps of dt. Fourth order reaches the accuracy of dt with
+    much longer steps, and the default tolerance lets the steps of typical packets grow to 4*dt or 8*dt and those of slow ones much further.
+    Steps are always dt times a power of two, so only a few matrices are ever factored and each is built once through the propagator cache.
+    Only the last step of advance() may be shorter than the shortest of them, and its operators are built for it alone."""
+
+    # The fractions of the step taken by the three Crank-Nicolson steps of the triple jump
+    g1 = 1/(2 - 2**(1/3))
+    g2 = 1 - 2*g1
+
+    def __init__(self, Potential, tolerance=1e-3, min_level=-4, max_level=10, **constants):
+        """Initialize with the potential, the relative error allowed in each step and the range of steps, dt*2**min_level to dt*2**max_level."""
+        super().__init__(**constants)
+        if callable(Potential):
+            Potential = evaluate(Potential, np.linspace(self.x0, (self.L + self.x0), self.N))
+        elif len(Potential) != self.N:
+            self._set_grid(len(Potential))
+        self.Potential = Potential
+        self.tolerance = tolerance
+        self.min_level = min_level
+        self.max_level = max_level
+        self.level = 2
+        self.accepted = 0
+        self.rejected = 0
+        self._operators = {}
+        self._buffers = None
+        # The length of the last step of advance(), which is shorter than any level, and its operators
+        self._remainder = None
+
+
+    def operator(self, level, fraction=1.0):
+        """Return the Crank-Nicolson operator for the time step fraction*dt*2**level."""
+        if (level, fraction) not in self._operators:
+            constants = self._get_constant_dict()
+            constants["dt"] = fraction*self.dt*2.0**level
+            self._operators[level, fraction] = propagator_cache("crank-nicolson", self.Potential, {}, constants)
+        return self._operators[level, fraction]
+
+
+    def error(self, second, fourth):
+        """Estimate the relative error of the second order step from the difference to the fourth order one, taking the worst state of an ensemble."""
+        difference = fourth - second
+        if difference.ndim == 1:
+            # A single state, for which the dot products are a few times faster than the sums over an ensemble
+            return np.sqrt(np.vdot(difference, difference).real/(np.vdot(fourth, fourth).real + 1e-300))
+        difference = np.sum(np.abs(difference)**2, axis=0)
+        norm = np.sum(np.abs(fourth)**2, axis=0)
+        return np.amax(np.sqrt(difference/(norm + 1e-300)))
+
+
+    def step(self, wavefunction, t_max=np.inf):
+        """Take one accepted step, no longer than t_max, and return the time it advanced.
+        A step that is already as short as min_level allows is accepted even if it is not within tolerance."""
+        level = min(self.level, self.max_level)
+        while level > self.min_level and self.dt*2.0**level > t_max*(1 + 1e-9):
+            level -= 1
+        psi = np.asarray(wavefunction.x, self.dtype)
+        # The states of the trial steps are solved into the same buffers every step instead of new wavefunctions
+        if self._buffers is None or self._buffers[0].shape != psi.shape:
+            self._buffers = tuple(np.empty(psi.shape, self.dtype) for _ in range(4))
+        second, first, fourth, longer = self._buffers
+        if self.dt*2.0**level > t_max*(1 + 1e-9):
+            # Less than the shortest step is left, so finish with one triple jump of exactly that length. Its operators fit no other step,
+            # so they are kept in a private slot rather than the propagator cache, where every odd remainder would evict a useful operator
+            if self._remainder is None or self._remainder[0] != t_max:
+                constants = self._get_constant_dict()
+                operators = []
+                for fraction in (self.g1, self.g2):
+                    constants["dt"] = fraction*t_max
+                    operators.append(UnitaryOperation(self.Potential, **constants))
+                self._remainder = (t_max, operators)
+            outer, inner = self._remainder[1]
+            first = outer.solve(psi, first)
+            fourth = inner.solve(first, fourth)
+            first = outer.solve(fourth, first)
+            wavefunction.x = np.copy(first)
+            return t_max
+        longer_error = None
+        while True:
+            second = self.operator(level).solve(psi, second)
+            first = self.operator(level, self.g1).solve(psi, first)
+            fourth = self.operator(level, self.g2).solve(first, fourth)
+            first = self.operator(level, self.g1).solve(fourth, first)
+            error = self.error(second, first)
+            if error <= self.tolerance or level <= self.min_level:
+                break
+            if longer_error is not None and error > longer_error/2:
+                # Halving the step did not shrink the estimate, so it comes from modes too fine for the grid (noise, say)
+                # which no step follows, and the longer step is kept instead of shrinking down to min_level
+                level, error, first = level + 1, longer_error, longer
+                break
+            self.rejected += 1
+            longer, first, longer_error = first, longer, error
+            level -= 1
+        self.accepted += 1
+        wavefunction.x = np.copy(first)
+        # The estimate grows as the cube of the step, so doubling it is safe while it is under an eighth of the tolerance
+        self.level = level + 1 if error < self.tolerance/8 else level
+        return self.dt*2.0**level
+
+
+    def advance(self, wavefunction, t):
+        """Evolve the wavefunction by the time t in as few accepted steps as the tolerance allows, and return the number of steps taken."""
+        steps = 0
+        while t > 1e-9*self.dt:
+            t -= self.step(wavefunction, t)
+            steps += 1
+        return steps
+
+
+class NormMonitor:
+    """A cheap running check of the norm of a wavefunction, which every time evolution method keeps constant up to rounding.
+    The norm is only computed once every `every` steps, which costs one pass over psi. Once it has drifted from its value at reset()
+    by more than threshold, psi is renormalized. Drift that keeps coming back in single precision means the rounding is too large,
+    so after max_renormalizations of them the monitor asks for double precision instead.
+    Probability that leaves through absorbing layers is not drift, so it is taken off the norm to keep with absorb()."""
+
+    def __init__(self, threshold=1e-4, every=100, max_renormalizations=3):
+        """Initialize the monitor. It starts checking once reset() was called with the wavefunction."""
+        self.threshold = threshold
+        self.every = every
+        self.max_renormalizations = max_renormalizations
+        self.reference = None   # The norm of each state at reset()
+        self.drift = 0.0        # The largest relative drift of the norm at the last check
+        self.renormalizations = 0
+        self._steps = 0
+
+
+    def reset(self, wavefunction):
+        """Take the current norm of wavefunction as the one to keep."""
+        self.reference = self.norm(wavefunction)
+        self._initial = self.reference
+        self.drift = 0.0
+        self.renormalizations = 0
+        self._steps = 0
+
+
+    def norm(self, wavefunction):
+        """Return the norm of each state, integrated the same way as WaveFunctionCreator.normalize."""
+        return wavefunction.norm()
+
+
+    def absorb(self, probability):
+        """Lower the norm to keep by the probability absorbed since the last call, so that the loss is not renormalized away."""
+        if self.reference is not None:
+            self.reference = self.reference - probability
+
+
+    def __call__(self, wavefunction, steps=1):
+        """Count steps time steps taken on wavefunction and check its norm when a check is due.
+        Returns True if the drift keeps exceeding the threshold in single precision, meaning the precision should be raised."""
+        self._steps += steps
+        if self.reference is None or self._steps < self.every:
+            return False
+        self._steps = 0
+        norm = self.norm(wavefunction)
+        # Relative to the norm at reset(), since absorb() may have lowered the reference to almost nothing
+        self.drift = np.amax(np.abs(norm - self.reference)/self._initial)
+        if self.drift <= self.threshold:
+            return False
+        wavefunction.x = wavefunction.x*np.sqrt(self.reference/norm)
+        self.renormalizations += 1
+        return wavefunction.precision == "single" and self.renormalizations >= self.max_renormalizations
+
+
+# The time evolution operators that Quantum can be built with
+propagators = {"crank-nicolson": UnitaryOperation, "split-operator": SplitOperator, "spectral": SpectralOperation}
+
+# The time evolution operators of the 2D mode, see Simulation2D
+propagators_2d = {"adi": ADIOperation}
+
+
+class PropagatorCache:
+    """A bounded, least recently used cache of time evolution operators.
+    Operators are keyed by a hash of the scaled potential on the grid together with the method, its options and (m, hbar, dx, dt, N, precision)
+    and the absorbing layers, so dragging a slider back to a value that was already seen reuses the operator instead of rebuilding it.
+    The oldest operators are evicted once there are more than max_entries of them or they use more than max_bytes."""
+
+    def __init__(self, max_entries=32, max_bytes=256*2**20):
+        """Initialize an empty cache."""
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._operators = OrderedDict()
+        # Operators may be requested from background threads, so the bookkeeping is locked (the building is not)
+        self._lock = threading.Lock()
+
+
+    def __len__(self):
+        """The number of cached operators."""
+        return len(self._operators)
+
+
+    def key(self, method, Potential, options, constants):
+        """Return the key of the operator of the given method for Potential, and Potential sampled on the grid."""
+        C = constant(**constants)
+        if callable(Potential):
+            Potential = evaluate(Potential, np.linspace(C.x0, (C.L + C.x0), C.N))
+        else:
+            C._set_grid(len(Potential))
+        V = np.ascontiguousarray(Potential*C._scales)
+        return (sha1(V.tobytes()).hexdigest(), V.dtype.str, method, tuple(sorted(options.items())), C.m, C.hbar, C.dx, C.dt, C.N, C.precision,
+                C.absorber, C.absorber_strength), Potential
+
+
+    def __call__(self, method, Potential, options, constants):
+        """Return the operator of the given method for Potential, building it only if it is not cached."""
+        key, Potential = self.key(method, Potential, options, constants)
+        with self._lock:
+            if key in self._operators:
+                self.hits += 1
+                self._operators.move_to_end(key)
+                return self._operators[key][0]
+            self.misses += 1
+        operator = (propagators[method] if method in propagators else propagators_2d[method])(Potential, **options, **constants)
+        self._insert(key, operator)
+        return operator
+
+
+    def insert(self, method, Potential, options, constants, operator):
+        """Cache an operator that was built elsewhere, for example restored from a checkpoint, as the one for Potential."""
+        self._insert(self.key(method, Potential, options, constants)[0], operator)
+
+
+    def _insert(self, key, operator):
+        """Cache operator under key, unless it is already there, and evict the oldest operators that no longer fit."""
+        size = operator_nbytes(operator)
+        with self._lock:
+            if key not in self._operators:
+                self._operators[key] = (operator, size)
+                self.nbytes += size
+            while len(self._operators) > 1 and (len(self._operators) > self.max_entries or self.nbytes > self.max_bytes):
+                _, (_, evicted_size) = self._operators.popitem(last=False)
+                self.nbytes -= evicted_size
+
+
+    def clear(self):
+        """Remove every cached operator, keeping the hit and miss counters."""
+        with self._lock:
+            self._operators.clear()
+            self.nbytes = 0
+
+
+    def info(self):
+        """Return the hit and miss counters and the current size of the cache."""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._operators), "nbytes": self.nbytes}
+
+
+def operator_nbytes(operator):
+    """Return the memory used by the arrays of an operator."""
+    size = 0
+    for value in vars(operator).values():
+        for array in (value if isinstance(value, tuple) else (value,)):
+            if isinstance(array, np.ndarray):
+                size += array.nbytes
+    return size
+
+
+# The operators built by Simulation, shared by every simulation in this process
+propagator_cache = PropagatorCache()
\ No newline at end of file
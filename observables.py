@@ -0,0 +1,160 @@
+"""
+observables.py
+
+Streaming observables of the wavefunction.
+It contains the class Observables, which measures the norm, the position and momentum expectation values, their spreads, the energy
+and the probability absorbed by absorbing layers of a Simulation every k time steps. Each measurement is a few vectorized passes over psi, and only a bounded history of them is kept,
+so long runs give time series without storing the wavefunctions.
+
+This module is only a collection of classes, so there is no point in running it.
+"""
+
+#import statements
+import numpy as np
+from collections import deque
+from collection import evaluate
+from mechanics import along_grid, trapezoid
+from timing import timers
+
+# The quantities in every measurement
+names = ("t", "norm", "x", "p", "delta_x", "delta_p", "E", "absorbed", "flux")
+
+
+class Observables:
+    """The observables of a Simulation, measured every `every` time steps.
+    Attached to a simulation with attach(), it is called after each step and measures when due.
+    Without being attached, stream() drives the simulation itself and yields each measurement.
+    Either way the measurements go into history, which keeps the newest maxlen of them (all of them if maxlen is None),
+    and are passed to every function in callbacks.
+    The momentum expectations use the FFT that psi.p caches for the display, and the energy uses the same finite difference Hamiltonian
+    as the Crank-Nicolson and spectral operators, so it is conserved by them up to rounding.
+    With absorbing layers, absorbed is the probability they took since psi was set and flux the rate at which they take it now,
+    2/hbar times the integral of W|psi|^2. The expectation values are then those of the part of psi that is left, normalized on its own."""
+
+    def __init__(self, simulation, every=1, maxlen=10000):
+        """Initialize the observables of simulation."""
+        self.simulation = simulation
+        self.every = every
+        self.history = deque(maxlen=maxlen)
+        self.callbacks = []
+        self._steps = 0
+        # The potential and momentum grid, sampled once and kept until the potential or the grid changes
+        self._V = None
+        self._V_source = None
+        self._p_grid = None
+        self._W = (None, None)
+
+
+    def attach(self):
+        """Measure after the steps of the simulation from now on."""
+        if self not in self.simulation.observers:
+            self.simulation.observers.append(self)
+
+
+    def detach(self):
+        """Stop measuring after the steps of the simulation."""
+        if self in self.simulation.observers:
+            self.simulation.observers.remove(self)
+
+
+    def potential(self):
+        """Return the potential the operator was built from on the grid, scaled the way the operators scale it."""
+        sim = self.simulation
+        if getattr(sim, "V_t", None) is not None:
+            # A time dependent potential changes every step, so it is sampled at the current time instead of being kept
+            return np.real(np.asarray(evaluate(lambda x: sim.V_t(x, sim._t), sim.x), np.float64))*sim._scales
+        source = sim._V_unitary
+        if self._V_source is not source or len(self._V) != sim.N:
+            V = evaluate(source, sim.x) if callable(source) else source
+            self._V = np.real(np.asarray(V, np.float64))*sim._scales
+            self._V_source = source
+        return self._V
+
+
+    def momentum_grid(self):
+        """Return the momenta of the points of psi.p, which is shifted so that p = 0 is in the middle."""
+        sim = self.simulation
+        if self._p_grid is None or len(self._p_grid) != sim.N:
+            self._p_grid = sim.hbar*2.0*np.pi*np.fft.fftshift(np.fft.fftfreq(sim.N, d=sim.dx))
+        return self._p_grid
+
+
+    def absorbing_potential(self):
+        """Return W of the absorbing layers on the grid, sampled once and kept until the grid or the layers change."""
+        sim = self.simulation
+        layers = (sim.N, sim.x0, sim.L, sim.absorber, sim.absorber_strength)
+        if self._W[0] != layers:
+            self._W = (layers, sim.absorbing_potential())
+        return self._W[1]
+
+
+    def measure(self, wavefunction=None):
+        """Return the observables of wavefunction, the simulation's psi if None, as a dict keyed by names.
+        For an ensemble every value but t is an array with one entry per state."""
+        with timers.stage("observables"):
+            sim = self.simulation
+            if wavefunction is None:
+                wavefunction = sim.psi
+            psi = wavefunction.x
+            dx = sim.dx
+            x = along_grid(sim.x, psi)
+            density = np.real(np.conj(psi)*psi)
+            # The trapezoid rule of WaveFunctionCreator.norm(), which NormMonitor and absorbed are measured with too
+            norm = trapezoid(density, dx=dx, axis=0)
+            x_mean = np.sum(x*density, axis=0)*dx/norm
+            x2_mean = np.sum(x**2*density, axis=0)*dx/norm
+            # Momentum from the cached momentum representation, normalized on its own so that its scaling does not matter
+            p = along_grid(self.momentum_grid(), psi)
+            phi = wavefunction.p
+            p_density = np.real(np.conj(phi)*phi)
+            p_norm = np.sum(p_density, axis=0)
+            p_mean = np.sum(p*p_density, axis=0)/p_norm
+            p2_mean = np.sum(p**2*p_density, axis=0)/p_norm
+            # <T> of the finite difference Laplacian with psi = 0 beyond the walls, written as a sum of squared differences
+            differences = np.sum(np.abs(np.diff(psi, axis=0))**2, axis=0) + np.abs(psi[0])**2 + np.abs(psi[-1])**2
+            kinetic = sim.hbar**2/(2*sim.m*dx**2)*differences*dx/norm
+            potential = np.sum(along_grid(self.potential(), psi)*density, axis=0)*dx/norm
+            if sim.absorber > 0:
+                flux = 2/sim.hbar*np.sum(along_grid(self.absorbing_potential(), psi)*density, axis=0)*dx
+            else:
+                flux = 0*norm
+            return {"t": sim._t, "norm": norm, "x": x_mean, "p": p_mean,
+                    "delta_x": np.sqrt(np.maximum(x2_mean - x_mean**2, 0)), "delta_p": np.sqrt(np.maximum(p2_mean - p_mean**2, 0)),
+                    "E": kinetic + potential, "absorbed": sim.absorbed, "flux": flux}
+
+
+    def record(self):
+        """Measure the simulation's psi now, keep the measurement and pass it to the callbacks. Returns the measurement."""
+        sample = self.measure()
+        self.history.append(sample)
+        for callback in self.callbacks:
+            callback(sample)
+        return sample
+
+
+    def __call__(self, steps=1):
+        """Count steps time steps of the simulation and measure once every `every` of them."""
+        self._steps += steps
+        if self._steps >= self.every:
+            self._steps = 0
+            self.record()
+
+
+    def stream(self, steps):
+        """Advance the simulation by steps time steps and yield a measurement every `every` of them, starting with one before the first step."""
+        sim = self.simulation
+        yield self.record()
+        fpi = sim.fpi
+        try:
+            while steps > 0:
+                sim.fpi = min(self.every, steps)
+                sim.step()
+                steps -= sim.fpi
+                yield self.record()
+        finally:
+            sim.fpi = fpi
+
+
+    def series(self):
+        """Return the history as a dict of arrays keyed by names, one entry per measurement."""
+        return {name: np.array([sample[name] for sample in self.history]) for name in names}
\ No newline at end of file
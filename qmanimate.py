@@ -7,47 +7,65 @@ qmanimate.py
 
 Matplotlib animation for graphing the single quantum particle wavefunction. 
 This module is used in main.py for the graphing of the particle.
-It contains the class Quantum, which is essentially where all the plots are created from the parsed input.
+It contains the class Quantum, which is essentially where all the plots are created from the parsed input,
+and the class Quantum2D, which draws a particle in 2D as an image of its probability density.
 
 This module is only a collection of classes, so there is no point in running it.
 """
 
 #import statements
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-from collection import Function, constant, scales
-from mechanics import WaveFunctionCreator, UnitaryOperation
+from functools import wraps
+from matplotlib.figure import Figure
+from collection import evaluate
+from mechanics import WaveFunctionCreator
+from simulation import Simulation, Simulation2D
+from observables import Observables
+from worker import FrameBuffer, PhysicsWorker
+from recorder import TrajectoryRecorder
+from timing import timers
 from time import perf_counter
 
 
-class Quantum(constant):
+def _time_blit(figure, ax):
+    """Time the blit of each frame, that is drawing the animated artists and copying them to the canvas, as the stage "blit" of the timers.
+    FuncAnimation does both after the frame function returns, through the axes' draw_artist and the canvas' blit, which are wrapped here."""
+    def timed(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timers.stage("blit"):
+                return function(*args, **kwargs)
+        return wrapper
+    # Wrapped only once, if the animation is started again
+    if not hasattr(ax.draw_artist, "__wrapped__"):
+        ax.draw_artist = timed(ax.draw_artist)
+    canvas = figure.canvas
+    if not hasattr(canvas.blit, "__wrapped__"):
+        canvas.blit = timed(canvas.blit)
+
+
+class Quantum(Simulation):
     """Quantum class is essentially where all the lines are graphed after parsing the input. T
-    his class is also a child class of the "constant" class of the “collection” module. 
+    his class is a child class of the headless "Simulation" class of the “simulation” module, which is itself a child of the "constant" class of the “collection” module. 
     It uses the “Function” class of the “collection” module to manipulate and parse the functions.  
     Moreover, it also uses the “WaveFunctionCreator” class and the “UnitaryOperation” class of the “mechanics” module for carrying out the quantum manipulations. """
 
-    def __init__(self, function="np.exp(-0.5*((x-0.25)/0.05)**2)", potential="(x)**2/2"):
-        """Initialize the animation."""
-        super().__init__()
-        self._msg = ""  # Temporary messages in the text
+    def __init__(self, function="exp(-0.5*((x-0.25)/0.05)**2)", potential="(x)**2/2", method="crank-nicolson", method_options=None, defer_unitary=False, background_rebuilds=False,
+                 threaded=False, physics_rate=None, display_interval=1, **constants):
+        """Initialize the animation.
+        The arguments are those of Simulation: method chooses the time evolution operator, defer_unitary builds the first operator in the background,
+        background_rebuilds builds every later one in the background and constants override the defaults.
+        If threaded is True, time evolution runs in a PhysicsWorker thread at physics_rate steps per second (as fast as possible if None),
+        and each frame, drawn every display_interval milliseconds, only shows its newest snapshot."""
         self._main_msg = ""  # Primary messages in this same text box.
         self._main_msg_store = "" # Store the primary message
-        self.psi_name = ""  # Name of the wavefunction
-        self.psi_latex = ""  # LaTEX name of the wavefunction
-        self.V_name = ""   # Name of the potential
-        self.V_latex = ""  # LaTEX name of the potential
-        self.identity_matrix = np.identity(self.N, np.complex128)
-        # Ticking int attributes
-        self.fpi = 1    # Set the number of time evolutions per animation frame
-        self._t = 0     # Time that has passed
-        self._msg_i = 0  # Message counter for displaying temporary messages
         self.fps = 30    # frames per second
         self.fps_total = 0  # Total number of fps
         self.avg_fps = 0  # Average fps
         self.ticks = 0    # total number of ticks
         self._x_ticks = []
         self.t_perf = [1.0, 0.]
+        self.first_frame_callback = None  # Called once when the first frame is drawn
         self._dpi = 120
         # Boolean Attributes
         # Display the probability function or not
@@ -57,105 +75,28 @@ class Quantum(constant):
         self._show_p = False
         # Whether to show expectation value or not
         self._show_exp_val = False
+        # Whether to show the stage timings over the plot, see show_timings
+        self._show_timings = False
         # tuple containing the position of the message
         self._msg_pos = (0, 0)
-        # Numpy array of positions
-        self.x = np.linspace(self.x0,(self.L + self.x0),self.N)
-        # the parameters
-        self.psi_base = None
-        self.psi_params = {}
-        self.V_base = None
-        self.V_params = {}
-        Function.add_function("arg", lambda theta: np.exp(2.0j*np.pi*theta))
-        self.set_wavefunction(function)
-        self.V_x = None
-        self.set_unitary(potential)
+        self.threaded = threaded
+        self.physics_rate = physics_rate
+        self.display_interval = display_interval
+        self.worker = None
+        self.recorder = None   # Records psi for playback, see start_recording
+        self._playback = None  # Index of the recorded snapshot shown instead of psi, None while live
+        self._playback_psi = None
+        self._fpi_before_playback = 0
+        self._V_t_scales = None   # The time dependent potential with the factors it is drawn with, see _draw_time_dependent_potential
+        super().__init__(function, potential, method=method, method_options=method_options, defer_unitary=defer_unitary, background_rebuilds=background_rebuilds, **constants)
+        # Measured on the shown wavefunction while the expectation values are displayed
+        self.observables = Observables(self, maxlen=1)
         self._init_plots()
 
 
-    def set_wavefunction(self, psi, normalize=True):
-        """Parse input to set the wavefunction attributes."""
-        if isinstance(psi, str):
-            try:
-                if psi.strip().replace(".", "").replace("-", "").replace("e", "").isnumeric():
-                    psi_x = float(psi)*np.ones([self.N])
-                    self.psi_name = psi
-                    self.psi_latex = "$%s$" % psi
-                    self.psi = WaveFunctionCreator(psi_x)
-                    self._msg = "$\psi(x, 0) =$ %s" % self.psi_latex
-                    self._msg_i = 45
-                    if normalize:
-                        self.psi.normalize()
-                    self.psi_base = None
-                    self.psi_params = {}
-                else:
-                    psi = psi.replace("^", "**")
-                    f = Function(psi, "x")
-                    self.psi_base = f
-                    psi_func = lambda x: f(x, *f.get_tupled_default_values())
-                    self.psi_name = str(f)
-                    self.psi_latex = "$" + f.latex_repr + "$"
-                    self.psi = WaveFunctionCreator(psi_func)
-                    self.psi_params = f.get_enumerated_default_values()
-                    self._msg = r"$\psi(x, 0) =$ %s" % self.psi_latex
-                    self._msg_i = 45
-                    if normalize:
-                        self.psi.normalize()
-            except (TypeError, AttributeError,SyntaxError, ValueError, NameError) as E:
-                print(E)
-        elif isinstance(psi, np.ndarray):
-            self.psi = WaveFunctionCreator(psi)
-            self.psi_name = "wavefunction"
-            self.psi_latex = "$\psi(x)$"
-            if normalize:
-                self.psi.normalize()
-        else:
-            print("Unable to parse input")
-
-
     def set_unitary(self, V):
-        """Parse input and set the unitary operator attributes.
-        This also sets up the potential function attributes in the process."""
-        if isinstance(V, str):
-            try:
-                if V.strip().replace(".", "").replace("-", "").replace("e", "").isnumeric():
-                    self.V_name = ""
-                    self.V_latex = str(np.round(float(V), 2))
-                    if float(V) == 0:
-                        V = 1e-30
-                        V_f = float(V)*np.ones([self.N])
-                        self.U_t = UnitaryOperation(np.copy(V_f))
-                        self.V_x = 0.0*V_f
-                    else:
-                        V_f = scales(float(V)*np.ones([self.N]), 15)
-                        self.V_x = V_f
-                        self.U_t = UnitaryOperation(np.copy(V_f))
-                        self.V_latex = "%sk" % (self.V_latex) if V_f[0] > 0 else " %sk" % (self.V_latex)
-                    self.V_params = {}
-                    self.V_base = None
-                else:
-                    V = V.replace("^", "**")
-                    f = Function(V, "x")
-                    self.V = lambda x: f(x, *f.get_tupled_default_values())
-                    self.V_x = scales(self.V(self.x), 15)
-                    self.V_name = str(f)
-                    self.V_latex = "$" + f.multiply_latex_string("k") + "$"
-                    self.U_t = UnitaryOperation(self.V)
-                    self.V_base = f
-                    self.V_params = f.get_enumerated_default_values()
-            except (TypeError, AttributeError,SyntaxError, ValueError, NameError) as E:
-                print(E)
-        elif isinstance(V, np.ndarray):
-            self.V_params = {}
-            self.V_base = None
-            self.V = None
-            self.V_x = scales(V, 15)
-            self.V_name = "V(x)"
-            self.V_latex = "$V(x)$"
-            self.U_t = UnitaryOperation(V)
-        else:
-            print("Unable to parse input")
-
+        """Parse input and set the unitary operator attributes, then redraw the potential."""
+        super().set_unitary(V)
         if hasattr(self, "lines"):
             self.updates_draw_potential()
 
@@ -176,6 +117,22 @@ class Quantum(constant):
             self.lines[4].set_ydata(self.x*0.0)
 
 
+    def _draw_time_dependent_potential(self):
+        """Draw V(x, t) at the time of the wavefunction, which is _t here as it is in export.py.
+        It is scaled as V(x, 0) is rather than to its own maximum in every frame, so that a potential that only grows and shrinks is seen to."""
+        if self._V_t_scales is None or self._V_t_scales[0] is not self.V_t:
+            V_0 = evaluate(lambda x: self.V_t(x, 0.), self.x)
+            V_max = np.amax(np.abs(V_0))
+            to_V_x = 15/V_max if V_max > 15 else 1.0
+            # The same peak updates_draw_potential draws at 95% of the plot
+            V_x = V_0*to_V_x
+            peak = np.amax(V_x[1:-2]) if np.amax(V_x > 0) else np.abs(np.amin(V_x[1:-2]))
+            self._V_t_scales = (self.V_t, to_V_x, self.bounds[-1]*0.95/peak if peak > 0 else 0.)
+        _, to_V_x, to_plot = self._V_t_scales
+        self.V_x = evaluate(self.V, self.x)*to_V_x
+        self.lines[4].set_ydata(self.V_x*to_plot)
+
+
     def display_probability(self, *args):
             """Show only the probability density"""
             self._display_probs = True
@@ -183,15 +140,15 @@ class Quantum(constant):
             self.lines[2].set_alpha(0.)
             self.lines[3].set_alpha(0.)
             if self._show_p:
-                self.lines[0].set_text("—— $|\psi(p)|^2$")
+                self.lines[0].set_text(r"—— $|\psi(p)|^2$")
             else:
-                self.lines[0].set_text("—— $|\psi(x)|^2$")
+                self.lines[0].set_text(r"—— $|\psi(x)|^2$")
             self.lines[6].set_alpha(0.)
             self.lines[7].set_alpha(0.)
 
 
     def display_wavefunction(self):
-        """Show the wavefunction \psi(x) and hide the probability density."""
+        r"""Show the wavefunction \psi(x) and hide the probability density."""
         self._display_probs = False
         self.lines[1].set_linewidth(0.75)
         self.lines[2].set_alpha(1.)
@@ -200,20 +157,22 @@ class Quantum(constant):
         self.lines[7].set_alpha(1.)
   
 
-    def set_m(self, m, *args):
-        """Change the mass of the particle"""
-        self.m = m
-        self.psi.m = m
-        self.U_t.m = m
-        self.set_unitary(self.V_x)
+    def display_expectation_values(self):
+        """Toggle showing <x> as a vertical line, and <x>, <p> and the energy as text."""
+        self._show_exp_val = not self._show_exp_val
+        alpha = 1. if self._show_exp_val else 0.
+        self.lines[8].set_alpha(alpha)
+        self.lines[9].set_alpha(alpha)
 
 
-    def _change_constant(self, hbar):
-        """Change constant"""
-        self.hbar = hbar
-        self.psi.hbar = hbar
-        self.U_t.hbar = hbar
-        self.set_unitary(self.V_x)
+    def show_timings(self, show=True):
+        """Enable the stage timers of the timing module and show their summary over the plot, or hide it again.
+        The timers stay enabled after the summary is hidden, so that they can still be exported."""
+        self._show_timings = show
+        if show:
+            timers.enabled = True
+        else:
+            self.lines[10].set_text("")
 
 
     def set_scales_y(self):
@@ -235,7 +194,7 @@ class Quantum(constant):
     def _init_plots(self):
         """Start the animation, in which the required matplotlib objects are initialized and the plot boundaries are determined."""
         # Make matplotlib figure object
-        self.figure = plt.figure(dpi=self._dpi)
+        self.figure = Figure(dpi=self._dpi)
         # Make a subplot object
         self.ax = self.figure.add_subplot(1, 1, 1)
         # Set the x limits of the plot
@@ -260,21 +219,28 @@ class Quantum(constant):
             line4, = self.ax.plot(self.x,(self.V_x/np.abs(np.amin(self.V_x[1:-2]))*0.95*self.bounds[-1]),color="darkslategray",linestyle='-',linewidth=0.5)
         else:
             line4, = self.ax.plot(self.x,self.x*0.0,color="darkslategray",linestyle='-',linewidth=0.5)
-        line0 = self.ax.text((xmax-xmin)*0.01 + xmin,ymin + (ymax-ymin)*0.05,"—— $|\psi(x)|$",alpha=1.,animated=True,color="black")
-        line5 = self.ax.text((xmax-xmin)*0.01 + xmin,ymin + (ymax-ymin)*0.,"—— $Re(\psi(x))$",alpha=1.,animated=True,color="C0")
-        line6 = self.ax.text((xmax-xmin)*0.01 + xmin,ymin + (ymax-ymin)*(-0.05),"—— $Im(\psi(x))$",alpha=1.,animated=True,color="C1")
+        line0 = self.ax.text((xmax-xmin)*0.01 + xmin,ymin + (ymax-ymin)*0.05,r"—— $|\psi(x)|$",alpha=1.,animated=True,color="black")
+        line5 = self.ax.text((xmax-xmin)*0.01 + xmin,ymin + (ymax-ymin)*0.,r"—— $Re(\psi(x))$",alpha=1.,animated=True,color="C0")
+        line6 = self.ax.text((xmax-xmin)*0.01 + xmin,ymin + (ymax-ymin)*(-0.05),r"—— $Im(\psi(x))$",alpha=1.,animated=True,color="C1")
         line7 = self.ax.text((xmax-xmin)*0.01 + xmin,ymin + (ymax-ymin)*(0.1),"—— V(x)",alpha=1.,color="darkslategray")
+        line8 = self.ax.axvline(0., color="gray", linestyle=":", linewidth=0.75, alpha=0., animated=True)
+        line9 = self.ax.text((xmax-xmin)*0.01 + xmin,ymax - (ymax-ymin)*0.05,"",alpha=0.,animated=True,color="black")
+        line10 = self.ax.text(xmax - (xmax-xmin)*0.01,ymax - (ymax-ymin)*0.05,"",animated=True,color="black",family="monospace",fontsize=7,ha="right",va="top")
         # Show the infinite square well boundary
         self.ax.plot([self.x0, self.x0], [-10, 10],
                      color="gray", linewidth=0.75)
         self.ax.plot([self.x0+self.L, self.x0+self.L], [-10, 10],
                      color="gray", linewidth=0.75)
+        # Shade the absorbing layers inside the walls
+        if self.absorber > 0:
+            self.ax.axvspan(self.x0, self.x0 + self.absorber, color="gray", alpha=0.15, linewidth=0)
+            self.ax.axvspan(self.x0 + self.L - self.absorber, self.x0 + self.L, color="gray", alpha=0.15, linewidth=0)
         # Record the plot boundaries
         ymin, ymax = self.ax.get_ylim()
         xmin, xmax = self.ax.get_xlim()
         self.bounds = xmin, xmax, ymin, ymax
         # Store each line in a list.
-        self.lines = [line0, line1, line2, line3,line4,line5, line6,line7]
+        self.lines = [line0, line1, line2, line3,line4,line5, line6,line7,line8,line9,line10]
         # Another round of setting up and scaling the line plots
         if np.amax(self.V_x > 0):
             V_max = np.amax(self.V_x[1:-2])
@@ -298,29 +264,27 @@ class Quantum(constant):
     def _animate(self, i: int) -> list:
         """Produce a single frame of animation.
         This of course involves advancing the wavefunctionin time using the unitary operator."""
+        if self.ticks == 0 and self.first_frame_callback is not None:
+            self.first_frame_callback()
+        # A frame of the stage timers runs from one call to the next, so it includes the blit and the event loop in between
+        timers.tick()
         self.t_perf[0] = self.t_perf[1]
         self.t_perf[1] = perf_counter()
-        # Time evolve the wavefunction
-        for _ in range(self.fpi):
-            self.U_t(self.psi)
-            self._t += self.dt
-        # Define and set psi depending on whether to show psi in the positionor momentum basis.
-        if self._show_p:
-            psi = self.psi.p
-        else:
-            psi = self.psi.x
-        # Set probability density or absolute value of wavefunction
-        if self._display_probs:
-            try:
-                self.lines[1].set_ydata(
-                    np.real(np.conj(psi)*psi)/3.0)
-            except FloatingPointError as E:
-                print(E)
+        # Time evolve the wavefunction, or take the newest snapshot from the worker that does, or show a recorded one
+        if self._playback is not None:
+            shown = self._playback_psi
+        elif self.worker is not None:
+            if self._frame_psi.dtype != self.frames.dtype:
+                # The precision changed, so the snapshots are read into a wavefunction of the new one
+                self._frame_psi = WaveFunctionCreator(np.zeros(np.shape(self._frame_psi.x), self.frames.dtype), **self._get_constant_dict())
+            if self.frames.latest(self._frame_psi.x) is not None:
+                # Assign the buffer back to itself so that the cached momentum representation is recomputed
+                self._frame_psi.x = self._frame_psi.x
+            shown = self._frame_psi
         else:
-            self.lines[1].set_ydata(np.abs(psi))
-        # Set real and imaginary values
-        self.lines[2].set_ydata(np.real(psi))
-        self.lines[3].set_ydata(np.imag(psi))
+            self.step()
+            shown = self.psi
+        self._update_lines(shown)
         # Find fps stats
         t0, tf = self.t_perf
         self.ticks += 1
@@ -328,11 +292,207 @@ class Quantum(constant):
         if self.ticks > 1:
             self.fps_total += self.fps
         self.avg_fps = int(self.fps_total/(self.ticks))
-        if self.ticks % 60 == 0:
-            pass
+        # The timings change too often to be read every frame, so their summary is only redrawn once a second
+        if self.ticks % 60 == 0 and self._show_timings:
+            self.lines[10].set_text(timers.report())
+        return self.lines
+
+
+    def _update_lines(self, shown):
+        """Set the animated lines to the wavefunction shown, a WaveFunctionCreator, in the chosen view.
+        This is all of a frame but the time evolution, so frames can also be drawn from recorded wavefunctions, see export.py."""
+        # Define and set psi depending on whether to show psi in the positionor momentum basis.
+        if self._show_p:
+            psi = shown.p
+        else:
+            psi = shown.x
+        with timers.stage("line updates"):
+            if self.V_t is not None and self._playback is None:
+                self._draw_time_dependent_potential()
+            # Set probability density or absolute value of wavefunction
+            if self._display_probs:
+                try:
+                    self.lines[1].set_ydata(
+                        np.real(np.conj(psi)*psi)/3.0)
+                except FloatingPointError as E:
+                    print(E)
+            else:
+                self.lines[1].set_ydata(np.abs(psi))
+            # Set real and imaginary values
+            self.lines[2].set_ydata(np.real(psi))
+            self.lines[3].set_ydata(np.imag(psi))
+        if self._show_exp_val:
+            sample = self.observables.measure(shown)
+            # psi(p) is drawn against the same axis as psi(x), so the line only marks <x> in position space
+            self.lines[8].set_alpha(0. if self._show_p else 1.)
+            self.lines[8].set_xdata([sample["x"], sample["x"]])
+            text = r"$\langle x \rangle = %.3f$   $\langle p \rangle = %.1f$   $E = %.4g$" % (sample["x"], sample["p"], sample["E"])
+            if self.absorber > 0:
+                text += "   absorbed $= %.3f$" % sample["absorbed"]
+            self.lines[9].set_text(text)
+
+
+    def start_recording(self, path, every=1, dtype=np.complex64, compress=False):
+        """Record psi every `every` time steps to the file path, so that the run can be scrubbed through with show_recorded.
+        dtype and compress are passed on to TrajectoryRecorder."""
+        with self.lock:
+            self.stop_recording()
+            self.recorder = TrajectoryRecorder(path, np.shape(self.psi.x), every, dtype, compress)
+            self.recorder.attach(self)
+
+
+    def stop_recording(self):
+        """Stop recording. What was recorded can still be played back."""
+        if self.recorder is not None:
+            with self.lock:
+                self.recorder.detach()
+
+
+    def show_recorded(self, t):
+        """Pause the time evolution and show the last snapshot recorded at or before the time t.
+        The snapshot is read from the recording, so moving back and forth in time recomputes nothing."""
+        if self.recorder is None or len(self.recorder) == 0:
+            return
+        if self._playback is None:
+            self._fpi_before_playback = self.fpi
+            self.fpi = 0
+        self._playback = self.recorder.index(t)
+        psi = self.recorder.frame(self._playback)
+        if psi.dtype.kind == "f":
+            # Only the probability density was recorded
+            psi = np.sqrt(psi)
+        if self._playback_psi is None:
+            self._playback_psi = WaveFunctionCreator(psi, **self._get_constant_dict())
+        else:
+            self._playback_psi.x = psi
+
+
+    def show_live(self):
+        """Leave playback and continue the time evolution from where it was paused."""
+        if self._playback is not None:
+            self._playback = None
+            if self.fpi == 0:
+                self.fpi = self._fpi_before_playback
+
+
+    def start_worker(self):
+        """Start evolving the wavefunction in a background PhysicsWorker thread that publishes into a FrameBuffer."""
+        self.frames = FrameBuffer(np.shape(self.psi.x), dtype=self.dtype)
+        self._frame_psi = WaveFunctionCreator(np.copy(self.psi.x), **self._get_constant_dict())
+        self.worker = PhysicsWorker(self, self.frames, self.physics_rate)
+        self.worker.start()
+
+
+    def stop_worker(self):
+        """Stop the background PhysicsWorker thread, if there is one."""
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker = None
+
+
+    def animation_loop(self) -> None:
+        """Produce all frames of animation."""
+        from matplotlib import animation
+        if self.threaded:
+            self.start_worker()
+        _time_blit(self.figure, self.ax)
+        self.main_animation = animation.FuncAnimation(self.figure, self._animate, blit=True,interval=self.display_interval)
+
+
+class Quantum2D(Simulation2D):
+    """Quantum2D draws a particle in 2D as an image of its probability density, with the contour lines of the potential over it.
+    It is the animated child class of the headless "Simulation2D" class of the “simulation” module, as Quantum is of Simulation."""
+
+    def __init__(self, function="exp(-0.5*(((x-0.25)/0.05)**2 + (y/0.05)**2))", potential="(x**2 + y**2)/2", method="adi", method_options=None, defer_unitary=False, background_rebuilds=False,
+                 threaded=False, physics_rate=None, display_interval=1, **constants):
+        """Initialize the animation. The arguments are those of Quantum, with the expressions of Simulation2D."""
+        self.fps = 30    # frames per second
+        self.ticks = 0    # total number of ticks
+        self.t_perf = [1.0, 0.]
+        self._dpi = 120
+        self.threaded = threaded
+        self.physics_rate = physics_rate
+        self.display_interval = display_interval
+        self.worker = None
+        self._contours = None
+        super().__init__(function, potential, method=method, method_options=method_options, defer_unitary=defer_unitary, background_rebuilds=background_rebuilds, **constants)
+        self._init_plots()
+
+
+    def _init_plots(self):
+        """Make the figure: the density image, the contour lines of the potential and the text with the time."""
+        self.figure = Figure(dpi=self._dpi)
+        self.ax = self.figure.add_subplot(1, 1, 1)
+        extent = (self.x0, self.x0 + self.L, self.x0, self.x0 + self.L)
+        density = self.psi.density()
+        self.image = self.ax.imshow(density, origin="lower", extent=extent, cmap="inferno", vmin=0., vmax=np.amax(density), interpolation="nearest", animated=True)
+        self.ax.set_xlabel("x")
+        self.ax.set_ylabel("y")
+        self.text = self.ax.text(self.x0 + 0.02*self.L, self.x0 + 0.95*self.L, "", color="white", animated=True)
+        self._draw_potential()
+        self.lines = [self.image, self.text]
+
+
+    def _draw_potential(self):
+        """Draw the contour lines of the potential, replacing the previous ones. They are not animated, so the canvas has to be drawn again."""
+        if self._contours is not None:
+            self._contours.remove()
+            self._contours = None
+        if np.ptp(self.V_x) > 0:
+            self._contours = self.ax.contour(self.x, self.x, self.V_x, levels=10, colors="white", linewidths=0.5, alpha=0.4)
+
+
+    def set_unitary(self, V):
+        """Set the potential and the operator, and redraw the contour lines of the potential."""
+        super().set_unitary(V)
+        if hasattr(self, "ax"):
+            self._draw_potential()
+
+
+    def _animate(self, i: int) -> list:
+        """Produce a single frame of animation: advance psi, or take the newest snapshot of the worker, and show its density."""
+        timers.tick()
+        self.t_perf[0] = self.t_perf[1]
+        self.t_perf[1] = perf_counter()
+        if self.worker is not None:
+            if self._frame_psi.dtype != self.frames.dtype:
+                self._frame_psi = np.zeros(self._frame_psi.shape, self.frames.dtype)
+            self.frames.latest(self._frame_psi)
+            psi = self._frame_psi
+        else:
+            self.step()
+            psi = self.psi.x
+        with timers.stage("line updates"):
+            density = np.real(np.conj(psi)*psi)
+            self.image.set_data(density)
+            # The peak falls as the packet spreads, so the colors follow it rather than fading
+            self.image.set_clim(0., max(np.amax(density), 1e-30))
+            self.text.set_text("t = %.5f" % self._t)
+        t0, tf = self.t_perf
+        self.ticks += 1
+        self.fps = int(1/(tf - t0 + 1e-30))
         return self.lines
 
 
+    def start_worker(self):
+        """Start evolving the wavefunction in a background PhysicsWorker thread that publishes into a FrameBuffer."""
+        self.frames = FrameBuffer(np.shape(self.psi.x), dtype=self.dtype)
+        self._frame_psi = np.copy(self.psi.x)
+        self.worker = PhysicsWorker(self, self.frames, self.physics_rate)
+        self.worker.start()
+
+
+    def stop_worker(self):
+        """Stop the background PhysicsWorker thread, if there is one."""
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker = None
+
+
     def animation_loop(self) -> None:
         """Produce all frames of animation."""
-        self.main_animation = animation.FuncAnimation(self.figure, self._animate, blit=True,interval=1)
\ No newline at end of file
+        from matplotlib import animation
+        if self.threaded:
+            self.start_worker()
+        _time_blit(self.figure, self.ax)
+        self.main_animation = animation.FuncAnimation(self.figure, self._animate, blit=True, interval=self.display_interval, cache_frame_data=False)
\ No newline at end of file
@@ -0,0 +1,206 @@
+"""
+recorder.py
+
+Recording of the wavefunction over time.
+It contains the class TrajectoryRecorder, which appends a snapshot of psi every k time steps to a memory mapped file on disk.
+Snapshots can be downcast to complex64, or to the float32 probability density, and compressed in chunks of several snapshots.
+Any recorded snapshot can be read back by its index or time, so the animation can scrub through a run without recomputing it.
+Only the pages of the map that are in use and at most two chunks stay in memory, so long runs take a fixed amount of RAM.
+
+This module is only a collection of classes, so there is no point in running it.
+"""
+
+#import statements
+import json
+import os
+import zlib
+import numpy as np
+
+
+class TrajectoryRecorder:
+    """Snapshots of psi appended to a file, and read back from it.
+    Without compression the file is a memory map of fixed size snapshots, which grows by doubling its capacity when it is full.
+    With compression, every chunk of snapshots is compressed with zlib and appended, and reading a snapshot decompresses its chunk.
+    dtype is the dtype the snapshots are stored in, np.complex64 or np.complex128 for psi, or np.float32 for only |psi|^2.
+    The times of the snapshots are kept in a second map, and the layout in a small JSON file next to the data, see open()."""
+
+    def __init__(self, path, shape, every=1, dtype=np.complex64, compress=False, chunk=64, capacity=1024):
+        """Initialize an empty recording in the file path, for snapshots of the given shape taken every `every` time steps."""
+        self.path = path
+        self.shape = tuple(shape)
+        self.every = every
+        self.dtype = np.dtype(dtype)
+        self.compress = compress
+        self.chunk = chunk
+        self.count = 0   # Number of snapshots recorded
+        self.simulation = None
+        self._steps = 0
+        self._capacity = capacity
+        self._times = np.memmap(path + ".times", np.float64, "w+", shape=(capacity,))
+        if compress:
+            # Snapshots wait in this buffer until a whole chunk can be compressed
+            self._buffer = np.empty((chunk,) + self.shape, self.dtype)
+            self._offsets = [0]
+            self._decoded = (None, None)
+            open(path, "wb").close()
+        else:
+            self._frames = np.memmap(path, self.dtype, "w+", shape=(capacity,) + self.shape)
+
+
+    @classmethod
+    def open(cls, path):
+        """Open a recording that was closed, for reading it back. Its files are mapped read only."""
+        with open(path + ".json") as f:
+            layout = json.load(f)
+        recorder = cls.__new__(cls)
+        recorder.path = path
+        recorder.shape = tuple(layout["shape"])
+        recorder.every = layout["every"]
+        recorder.dtype = np.dtype(layout["dtype"])
+        recorder.compress = layout["compress"]
+        recorder.chunk = layout["chunk"]
+        recorder.count = layout["count"]
+        recorder.simulation = None
+        recorder._steps = 0
+        recorder._capacity = max(recorder.count, 1)
+        recorder._times = np.memmap(path + ".times", np.float64, "r", shape=(recorder._capacity,))
+        if recorder.compress:
+            recorder._buffer = np.empty((recorder.chunk,) + recorder.shape, recorder.dtype)
+            recorder._offsets = layout["offsets"]
+            recorder._decoded = (None, None)
+            # The snapshots of the last, incomplete chunk were stored uncompressed after the chunks
+            pending = recorder.count % recorder.chunk
+            if pending:
+                recorder._buffer[:pending] = np.fromfile(path + ".pending", recorder.dtype).reshape((pending,) + recorder.shape)
+        else:
+            recorder._frames = np.memmap(path, recorder.dtype, "r", shape=(recorder._capacity,) + recorder.shape)
+        return recorder
+
+
+    def _grow(self):
+        """Double the capacity of the maps. Mapping a file in r+ mode with a larger shape extends it in place."""
+        self._capacity *= 2
+        self._times.flush()
+        self._times = np.memmap(self.path + ".times", np.float64, "r+", shape=(self._capacity,))
+        if not self.compress:
+            self._frames.flush()
+            self._frames = np.memmap(self.path, self.dtype, "r+", shape=(self._capacity,) + self.shape)
+
+
+    def __len__(self):
+        """The number of recorded snapshots."""
+        return self.count
+
+
+    def _snapshot(self, psi):
+        """Return psi converted to the stored dtype."""
+        if self.dtype.kind == "f":
+            return np.real(np.conj(psi)*psi)
+        return psi
+
+
+    def write(self, psi, t):
+        """Append the snapshot psi at time t."""
+        if self.count == self._capacity:
+            self._grow()
+        self._times[self.count] = t
+        if self.compress:
+            self._buffer[self.count % self.chunk] = self._snapshot(psi)
+            self.count += 1
+            if self.count % self.chunk == 0:
+                with open(self.path, "ab") as f:
+                    f.write(zlib.compress(self._buffer.tobytes(), 1))
+                    self._offsets.append(f.tell())
+        else:
+            self._frames[self.count] = self._snapshot(psi)
+            self.count += 1
+            # Write the pages of every chunk back to the file and drop them from memory, so that they do not pile up
+            if self.count % self.chunk == 0:
+                self._release()
+
+
+    def _release(self):
+        """Write the snapshots back to the file and drop the pages of the map from memory by mapping the file again.
+        They are read back from the file if they are needed again."""
+        self._frames.flush()
+        del self._frames
+        self._frames = np.memmap(self.path, self.dtype, "r+", shape=(self._capacity,) + self.shape)
+
+
+    def attach(self, simulation):
+        """Record the psi of simulation every `every` of its time steps from now on, starting with the current one."""
+        self.simulation = simulation
+        self.write(simulation.psi.x, simulation._t)
+        if self not in simulation.observers:
+            simulation.observers.append(self)
+
+
+    def detach(self):
+        """Stop recording the simulation."""
+        if self.simulation is not None and self in self.simulation.observers:
+            self.simulation.observers.remove(self)
+        self.simulation = None
+
+
+    def __call__(self, steps=1):
+        """Count steps time steps of the attached simulation and record its psi once every `every` of them."""
+        self._steps += steps
+        if self._steps >= self.every:
+            self._steps = 0
+            self.write(self.simulation.psi.x, self.simulation._t)
+
+
+    @property
+    def times(self):
+        """The times of the recorded snapshots."""
+        return self._times[:self.count]
+
+
+    def index(self, t):
+        """Return the index of the last snapshot recorded at or before the time t."""
+        return int(np.clip(np.searchsorted(self.times, t, side="right") - 1, 0, max(self.count - 1, 0)))
+
+
+    def frame(self, i, out=None):
+        """Return the snapshot i, copied into out if it is given. Only the pages or the chunk holding it are read."""
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("snapshot %d out of range, %d were recorded" % (i, self.count))
+        if not self.compress:
+            snapshot = self._frames[i]
+        elif i >= (len(self._offsets) - 1)*self.chunk:
+            snapshot = self._buffer[i % self.chunk]
+        else:
+            n = i//self.chunk
+            if self._decoded[0] != n:
+                start, stop = self._offsets[n], self._offsets[n + 1]
+                data = zlib.decompress(np.fromfile(self.path, np.uint8, count=stop - start, offset=start).tobytes())
+                self._decoded = (n, np.frombuffer(data, self.dtype).reshape((self.chunk,) + self.shape))
+            snapshot = self._decoded[1][i % self.chunk]
+        if out is None:
+            return np.array(snapshot)
+        out[...] = snapshot
+        return out
+
+
+    def close(self):
+        """Stop recording and write everything needed by open() to disk."""
+        self.detach()
+        self._times.flush()
+        layout = {"shape": self.shape, "every": self.every, "dtype": self.dtype.str, "compress": self.compress, "chunk": self.chunk, "count": self.count}
+        if self.compress:
+            layout["offsets"] = self._offsets
+            pending = self.count % self.chunk
+            self._buffer[:pending].tofile(self.path + ".pending")
+        else:
+            self._frames.flush()
+        with open(self.path + ".json", "w") as f:
+            json.dump(layout, f)
+
+
+    def remove(self):
+        """Delete the files of the recording."""
+        for name in (self.path, self.path + ".times", self.path + ".json", self.path + ".pending"):
+            if os.path.exists(name):
+                os.remove(name)
\ No newline at end of file
@@ -0,0 +1,675 @@
+"""
+simulation.py
+
+Headless single-particle 1D quantum simulation.
+It contains the class Simulation, which holds the wavefunction, the potential and the time evolution operator and steps them in time.
+It does not import Tkinter or matplotlib, so it can run in batch jobs on machines without a display.
+Quantum in qmanimate.py is the animated child class of Simulation.
+Simulation2D is the same for a particle in 2D, psi(x, y) in V(x, y), and Quantum2D its animated child class.
+
+Run this file for a simulation from the command line, for example
+python simulation.py --psi "exp(-0.5*((x-0.25)/0.05)**2)" --potential "x**2/2" -N 4096 --steps 10000 --output run.npz
+"""
+
+#import statements
+import argparse
+import re
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from math import gcd
+from time import perf_counter
+from collection import Function, constant, scales, evaluate, precisions
+from mechanics import WaveFunctionCreator, WaveFunction2D, AdaptiveOperation, TimeDependentOperation, NormMonitor, propagators, propagators_2d, propagator_cache
+from observables import Observables
+from recorder import TrajectoryRecorder
+from checkpoint import save_checkpoint, load_checkpoint
+from timing import timers
+
+
+class Simulation(constant):
+    """Simulation class holds the state of the particle and advances it in time, without any rendering.
+    It parses the wavefunction and potential with the “Function” class of the “collection” module,
+    and uses the “WaveFunctionCreator” class and the time evolution operators of the “mechanics” module."""
+    # The methods it can be built with and the variables of its expressions
+    propagators = propagators
+    variables = "x"
+
+    def __init__(self, function="exp(-0.5*((x-0.25)/0.05)**2)", potential="(x)**2/2", method="crank-nicolson", method_options=None, defer_unitary=False, background_rebuilds=False, **constants):
+        """Initialize the simulation.
+        method chooses the time evolution operator, one of "crank-nicolson", "split-operator" or "spectral".
+        method_options are passed on to the operator, for example {"modes": 64} for the spectral method.
+        If defer_unitary is True, the first operator is built in a background thread and step() does nothing until it is ready.
+        If background_rebuilds is True, every later operator is built in the background too, see request_unitary.
+        constants override the defaults of the constant class, for example N=4096, dt=1e-6 or precision="double"."""
+        super().__init__(**constants)
+        if method not in self.propagators:
+            raise ValueError("Unknown time evolution method %s, choose from %s" % (method, ", ".join(self.propagators)))
+        if self.absorber > 0 and method == "spectral":
+            raise ValueError("The spectral method cannot have absorbing layers, choose crank-nicolson or split-operator")
+        self.method = method
+        self.method_options = {} if method_options is None else method_options
+        self._msg = ""  # Temporary messages in the text
+        self._msg_i = 0  # Message counter for displaying temporary messages
+        self.psi_name = ""  # Name of the wavefunction
+        self.psi_latex = ""  # LaTEX name of the wavefunction
+        self.V_name = ""   # Name of the potential
+        self.V_latex = ""  # LaTEX name of the potential
+        # Ticking int attributes
+        self.fpi = 1    # Set the number of time evolutions per step
+        self._U_fused = {}   # Operators for fpi time evolutions, by fpi
+        self._U_fused_base = None   # The operator they were built from
+        self._t = 0     # Time that has passed
+        # Held while stepping, so that a background worker and the GUI do not change psi at the same time
+        self.lock = threading.RLock()
+        # Numpy array of positions
+        self.x = np.linspace(self.x0,(self.L + self.x0),self.N)
+        # the parameters
+        self.psi_base = None
+        self.psi_params = {}
+        self.V_base = None
+        self.V_params = {}
+        self.V_t = None   # The potential as a function of x and t, if it depends on time
+        Function.add_function("arg", lambda theta: np.exp(2.0j*np.pi*theta))
+        # Renormalizes psi, or raises the precision, when rounding makes its norm drift
+        self.norm_monitor = NormMonitor()
+        # Functions called with the number of time steps after every step, for example Observables
+        self.observers = []
+        # The probability absorbed by the absorbing layers since psi was set, and the rate of the last step
+        self.absorbed = 0.
+        self.absorption_rate = 0.
+        self.set_wavefunction(function)
+        self.V_x = None
+        self.U_t = None
+        self.unitary_build_time = None   # Seconds the last background operator took to build
+        self.background_rebuilds = background_rebuilds
+        self._unitary_executor = None
+        self._unitary_future = None
+        self._unitary_generation = 0
+        self._V_unitary = None   # The potential the operator was last built from
+        self._V_requested = None   # The potential of the pending background build, until it is swapped in
+        self._adaptive = None    # The adaptive time stepper of advance(), see AdaptiveOperation
+        self._defer_unitary = defer_unitary
+        self.set_unitary(potential)
+        self._defer_unitary = False
+
+
+    def set_wavefunction(self, psi, normalize=True):
+        """Parse input to set the wavefunction attributes."""
+        if isinstance(psi, str):
+            try:
+                if psi.strip().replace(".", "").replace("-", "").replace("e", "").isnumeric():
+                    psi_x = float(psi)*np.ones([self.N])
+                    self.psi_name = psi
+                    self.psi_latex = "$%s$" % psi
+                    self.psi = WaveFunctionCreator(psi_x, **self._get_constant_dict())
+                    self._msg = r"$\psi(x, 0) =$ %s" % self.psi_latex
+                    self._msg_i = 45
+                    if normalize:
+                        self.psi.normalize()
+                    self.psi_base = None
+                    self.psi_params = {}
+                else:
+                    psi = psi.replace("^", "**")
+                    f = Function(psi, "x")
+                    self.psi_base = f
+                    defaults = f.get_tupled_default_values()
+                    psi_func = lambda x: f(x, *defaults)
+                    self.psi_name = str(f)
+                    self.psi_latex = "$" + f.latex_repr + "$"
+                    self.psi = WaveFunctionCreator(psi_func, **self._get_constant_dict())
+                    self.psi_params = f.get_enumerated_default_values()
+                    self._msg = r"$\psi(x, 0) =$ %s" % self.psi_latex
+                    self._msg_i = 45
+                    if normalize:
+                        self.psi.normalize()
+            except (TypeError, AttributeError,SyntaxError, ValueError, NameError) as E:
+                print(E)
+        elif isinstance(psi, np.ndarray):
+            self.psi = WaveFunctionCreator(psi, **self._get_constant_dict())
+            self.psi_name = "wavefunction"
+            self.psi_latex = r"$\psi(x)$"
+            if normalize:
+                self.psi.normalize()
+        else:
+            print("Unable to parse input")
+        if hasattr(self, "psi"):
+            self.norm_monitor.reset(self.psi)
+            self.absorbed = 0.
+            self.absorption_rate = 0.
+
+
+    def set_unitary(self, V):
+        """Parse input and set the unitary operator attributes.
+        This also sets up the potential function attributes in the process.
+        An expression that contains t is a time dependent potential V(x, t), evolved with TimeDependentOperation whatever the method is."""
+        self.V_t = None
+        if isinstance(V, str):
+            try:
+                if V.strip().replace(".", "").replace("-", "").replace("e", "").isnumeric():
+                    self.V_name = ""
+                    self.V_latex = str(np.round(float(V), 2))
+                    if float(V) == 0:
+                        V = 1e-30
+                        V_f = float(V)*np.ones([self.N])
+                        self._build_unitary(np.copy(V_f))
+                        self.V_x = 0.0*V_f
+                    else:
+                        V_f = scales(float(V)*np.ones([self.N]), 15)
+                        self.V_x = V_f
+                        self._build_unitary(np.copy(V_f))
+                        self.V_latex = "%sk" % (self.V_latex) if V_f[0] > 0 else " %sk" % (self.V_latex)
+                    self.V_params = {}
+                    self.V_base = None
+                else:
+                    V = V.replace("^", "**")
+                    # t is the time rather than a parameter, so V_base then takes x and t before the parameters
+                    time_dependent = re.search(r"\bt\b", V) is not None
+                    f = Function(V, ["x", "t"] if time_dependent else "x")
+                    defaults = f.get_tupled_default_values()
+                    if time_dependent:
+                        self.V_t = lambda x, t: f(x, t, *defaults)
+                        self.V = lambda x: self.V_t(x, self._t)
+                        if self.method != "crank-nicolson":
+                            print("V(x, t) is evolved with the time dependent operator instead of %s" % self.method)
+                    else:
+                        self.V = lambda x: f(x, *defaults)
+                    self.V_x = scales(evaluate(self.V, self.x), 15)
+                    self.V_name = str(f)
+                    self.V_latex = "$" + f.multiply_latex_string("k") + "$"
+                    self._build_unitary(self.V)
+                    self.V_base = f
+                    self.V_params = f.get_enumerated_default_values()
+            except (TypeError, AttributeError,SyntaxError, ValueError, NameError) as E:
+                print(E)
+        elif isinstance(V, np.ndarray):
+            self.V_params = {}
+            self.V_base = None
+            self.V = None
+            self.V_x = scales(V, 15)
+            self.V_name = "V(x)"
+            self.V_latex = "$V(x)$"
+            self._build_unitary(V)
+        else:
+            print("Unable to parse input")
+
+
+    def _build_unitary(self, V):
+        """Set U_t to the operator for V.
+        With background rebuilds, or while the first operator is deferred, it is requested from the background builder instead."""
+        if self._defer_unitary or self.background_rebuilds:
+            self.request_unitary(V)
+        else:
+            self._cancel_unitary_request()
+            self.U_t = self.make_unitary(V)
+            self._V_unitary = V
+
+
+    def set_potential_parameters(self, params):
+        """Set the free parameters of the parsed potential to the values params, in the order of V_params, and build its operator."""
+        if self.V_t is not None:
+            self.V_t = lambda x, t: self.V_base(x, t, *params)
+            self.V = lambda x: self.V_t(x, self._t)
+        else:
+            self.V = lambda x: self.V_base(x, *params)
+        self.V_x = scales(evaluate(self.V, self.x), 15)
+        self._build_unitary(self.V)
+
+
+    def request_unitary(self, V):
+        """Build the operator for V in a background thread and swap it in once it is ready, stepping with the old operator meanwhile.
+        A newer request supersedes an older one: the older job is cancelled if it has not started, and its operator is dropped if it has."""
+        if self._unitary_executor is None:
+            self._unitary_executor = ThreadPoolExecutor(max_workers=1)
+        with self.lock:
+            generation = self._cancel_unitary_request()
+            self._V_requested = V
+            self._unitary_future = self._unitary_executor.submit(self._timed_make_unitary, V)
+            self._unitary_future.add_done_callback(lambda future: self._swap_unitary(future, generation, V))
+
+
+    def _cancel_unitary_request(self):
+        """Cancel the pending background build, if any, and return the generation number of the next request."""
+        with self.lock:
+            self._unitary_generation += 1
+            self._V_requested = None
+            if self._unitary_future is not None:
+                self._unitary_future.cancel()
+                self._unitary_future = None
+            return self._unitary_generation
+
+
+    def _timed_make_unitary(self, V):
+        """Build the operator for V and return it with the seconds it took. This runs in the background thread."""
+        t0 = perf_counter()
+        U_t = self.make_unitary(V)
+        return U_t, perf_counter() - t0
+
+
+    def _swap_unitary(self, future, generation, V):
+        """Swap in a finished background operator for V, unless a newer request or a direct change of U_t came after it.
+        V only becomes the potential the operator was built from here, so the two always belong together."""
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            print(future.exception())
+            with self.lock:
+                if generation == self._unitary_generation:
+                    self._V_requested = None
+            return
+        with self.lock:
+            if generation == self._unitary_generation:
+                self.U_t, self.unitary_build_time = future.result()
+                self._V_unitary = V
+                self._V_requested = None
+
+
+    def _latest_potential(self):
+        """Return the potential of the pending background build, or the one the operator was built from if none is pending."""
+        with self.lock:
+            return self._V_unitary if self._V_requested is None else self._V_requested
+
+
+    def make_unitary(self, V):
+        """Build the time evolution operator for the potential V with the chosen method.
+        Operators are shared through the propagator cache, so a potential that was seen before is not built again.
+        A time dependent potential gets a TimeDependentOperation starting at the current time, which is neither cached nor shared."""
+        with timers.stage("operator build"):
+            if self.V_t is not None:
+                return TimeDependentOperation(self.V_t, self._t, **self._get_constant_dict())
+            return propagator_cache(self.method, V, self.method_options, self._get_constant_dict())
+
+
+    def update_potential(self, indices):
+        """Apply a local edit of V_x at the grid points indices to the operator.
+        V_x is the display copy, scaled down by scales() when the potential exceeds 15, so the edit is first converted back to the units
+        of the potential the operator was built from, which then holds the edit as an array.
+        Operators that support it are updated in O(N) instead of being rebuilt, on a copy so that the cached operator stays valid.
+        The others are rebuilt by the background builder, so that a sketch does not factor an operator in every mouse event and the newest edit supersedes the older ones.
+        While a background build is pending the operator is still the old one, so the edit is applied to the potential being built and that is requested instead."""
+        with self.lock:
+            V = self._latest_potential()
+            if len(indices) == 0 or V is None:
+                return
+            pending = self._V_requested is not None
+        V = evaluate(V, self.x) if callable(V) else np.array(V, np.float64)
+        # V_x is V times one factor, which the points that were not edited still show
+        unchanged = np.ones(len(V), bool)
+        unchanged[indices] = False
+        V_max, V_x_max = np.amax(np.abs(V[unchanged]), initial=0), np.amax(np.abs(self.V_x[unchanged]), initial=0)
+        factor = V_x_max/V_max if V_max > 0 and V_x_max > 0 else 1.0
+        V[indices] = self.V_x[indices]/factor
+        # A sketched potential no longer depends on time
+        self.V_t = None
+        U_t = None if pending or self.U_t is None else copy(self.U_t)
+        if U_t is not None and U_t.update_potential(indices, V[indices]):
+            self._cancel_unitary_request()
+            self.U_t = U_t
+            self._V_unitary = V
+        else:
+            self.request_unitary(np.copy(V))
+
+
+    def fused_unitary(self):
+        """Return the operator that applies fpi time steps at once.
+        It is cached for each fpi and only rebuilt after the speed or the operator changed."""
+        if self._U_fused_base is not self.U_t:
+            self._U_fused = {}
+            self._U_fused_base = self.U_t
+        if self.fpi not in self._U_fused:
+            self._U_fused[self.fpi] = self.U_t.power(self.fpi)
+        return self._U_fused[self.fpi]
+
+
+    def seek(self, t):
+        """Move the wavefunction to the time t.
+        The spectral method jumps there with one projection in either direction, the other methods step forward to it."""
+        if hasattr(self.U_t, "evolve"):
+            self.U_t.evolve(self.psi, t - self._t)
+            self._t = t
+        else:
+            self._sync_time()
+            steps = int(round((t - self._t)/self.dt))
+            norm = self.psi.norm() if self.absorber > 0 and steps > 0 else None
+            for _ in range(steps):
+                self.U_t(self.psi)
+                self._t += self.dt
+            if norm is not None:
+                self._absorb(norm, steps*self.dt)
+
+
+    def _sync_time(self):
+        """Start the next step of a time dependent operator at the time of psi, which may have been moved by seek() or a restore."""
+        if isinstance(self.U_t, TimeDependentOperation):
+            self.U_t.t = self._t
+
+
+    def _absorb(self, norm, t):
+        """Account for the probability the absorbing layers took from psi over the time t, given its norm before."""
+        absorbed = norm - self.psi.norm()
+        self.absorbed = self.absorbed + absorbed
+        self.absorption_rate = absorbed/t
+        self.norm_monitor.absorb(absorbed)
+
+
+    def step(self):
+        """Advance the wavefunction by fpi time steps. Nothing happens until the operator has been built.
+        With absorbing layers the norm of psi is taken before and after, which adds the probability they absorbed to absorbed."""
+        with self.lock:
+            if self.fpi > 0 and self.U_t is not None:
+                self._sync_time()
+                norm = self.psi.norm() if self.absorber > 0 else None
+                with timers.stage("evolution"):
+                    self.fused_unitary()(self.psi)
+                self._t += self.fpi*self.dt
+                if norm is not None:
+                    self._absorb(norm, self.fpi*self.dt)
+                if self.norm_monitor(self.psi, self.fpi):
+                    self.set_precision("double")
+                for observer in self.observers:
+                    observer(self.fpi)
+
+
+    def run(self, steps, every=0):
+        """Advance the wavefunction by steps time steps, as fast as possible.
+        If every is nonzero, a copy of psi is kept every that many steps, and the times and copies are returned.
+        The steps are taken in chunks that also line up with the intervals of observers that measure every k steps."""
+        times, snapshots = [], []
+        fpi = self.fpi
+        chunk = every if every > 0 else steps
+        for observer in self.observers:
+            chunk = gcd(chunk, getattr(observer, "every", chunk))
+        done = 0
+        while done < steps:
+            self.fpi = min(chunk, steps - done)
+            self.step()
+            done += self.fpi
+            if every > 0 and (done % every == 0 or done == steps):
+                times.append(self._t)
+                snapshots.append(np.copy(self.psi.x))
+        self.fpi = fpi
+        return np.array(times), np.array(snapshots)
+
+
+    def advance(self, t, tolerance=1e-3):
+        """Advance the wavefunction by the time t with adaptive fourth order steps made of Crank-Nicolson steps and return the number of steps taken.
+        tolerance is the relative error allowed in each step, see AdaptiveOperation. The step sizes it settled on are kept for the next call.
+        A time dependent potential is stepped with dt instead, since the adaptive operators are built for a static one."""
+        if self.V_t is not None:
+            steps = int(round(t/self.dt))
+            self.run(steps)
+            return steps
+        with self.lock:
+            # The stepper is rebuilt after the potential or the constants changed, which the key of the propagator cache tells from its content
+            key, V = propagator_cache.key("crank-nicolson", self._latest_potential(), {}, self._get_constant_dict())
+            if self._adaptive is None or self._adaptive[0] != key:
+                self._adaptive = (key, AdaptiveOperation(V, tolerance, **self._get_constant_dict()))
+            adaptive = self._adaptive[1]
+            adaptive.tolerance = tolerance
+            norm = self.psi.norm() if self.absorber > 0 else None
+            steps = adaptive.advance(self.psi, t)
+            self._t += t
+            if norm is not None:
+                self._absorb(norm, t)
+            if self.norm_monitor(self.psi, steps):
+                self.set_precision("double")
+            # Observers count time steps of dt, however many adaptive steps covered them
+            for observer in self.observers:
+                observer(int(round(t/self.dt)))
+            return steps
+
+
+    def set_precision(self, precision):
+        """Switch psi, the operator and their buffers to precision, "single" (complex64) or "double" (complex128)."""
+        with self.lock:
+            if precision not in precisions:
+                raise ValueError("Unknown precision %s, choose from %s" % (precision, ", ".join(precisions)))
+            if precision == self.precision:
+                return
+            self.precision = precision
+            self.psi.precision = precision
+            self.psi.x = self.psi.x
+            print("Switched to %s precision" % precision)
+            self._build_unitary(self._latest_potential())
+            self.norm_monitor.reset(self.psi)
+
+
+    def save_checkpoint(self, path, operator=False, compress=False):
+        """Save psi, the potential, the constants, the expressions and the time to the file path, see checkpoint.py.
+        If operator is True the operator is saved too, so that restoring it factors nothing."""
+        with self.lock:
+            save_checkpoint(self, path, operator, compress)
+
+
+    @classmethod
+    def from_checkpoint(cls, path, parse=False, **options):
+        """Restore a simulation from the checkpoint file path. options are passed on to the class, for example threaded=True for Quantum.
+        The saved operator, if there is one, is put in the propagator cache, so it is found there instead of being built.
+        The expressions are only kept as text unless parse is True, since parsing them takes longer than restoring everything else.
+        A time dependent potential is always parsed, since the saved samples only hold it at one time."""
+        header, psi, V, operator = load_checkpoint(path)
+        constants = header["constants"]
+        if operator is not None:
+            propagator_cache.insert(header["method"], V, header["method_options"], constants, operator)
+        # Only the potential at the saved time is sampled, so a time dependent one is parsed again from its expression
+        time_dependent = header["V_expression"] is not None and re.search(r"\bt\b", header["V_expression"]) is not None
+        simulation = cls(psi, header["V_expression"] if time_dependent else V, method=header["method"], method_options=header["method_options"], **options, **constants)
+        # psi was normalized when it was set, so put the saved one back exactly
+        simulation.psi.x = psi
+        simulation.norm_monitor.reset(simulation.psi)
+        simulation._t = header["t"]
+        simulation.fpi = header["fpi"]
+        simulation.absorbed = np.array(header.get("absorbed", 0.))[()]
+        if time_dependent:
+            values = {name: value for name, value in header["V_params"].values()}
+            simulation.set_potential_parameters([values.get(str(s), value) for s, value in simulation.V_params.values()])
+        for name in ("psi_name", "psi_latex", "V_name", "V_latex", "psi_params", "V_params"):
+            setattr(simulation, name, header[name])
+        if parse:
+            for base, expression, params in (("psi_base", header["psi_expression"], "psi_params"), ("V_base", header["V_expression"], "V_params")):
+                if expression is not None and not (base == "V_base" and time_dependent):
+                    f = Function(expression, cls.variables)
+                    # The parameters of a parsed expression may come in another order, so they are matched by name
+                    values = {name: value for name, value in header[params].values()}
+                    setattr(simulation, base, f)
+                    setattr(simulation, params, {i: [s, values.get(str(s), value)] for i, (s, value) in f.get_enumerated_default_values().items()})
+        return simulation
+
+
+    def set_m(self, m, *args):
+        """Change the mass of the particle.
+        The operator is rebuilt from the potential it was built from rather than from the clipped V_x, and a time dependent potential stays one."""
+        self.m = m
+        self.psi.m = m
+        self._build_unitary(self._latest_potential())
+
+
+    def _change_constant(self, hbar):
+        """Change constant, rebuilding the operator from its potential as set_m does"""
+        self.hbar = hbar
+        self.psi.hbar = hbar
+        self._build_unitary(self._latest_potential())
+
+
+class Simulation2D(Simulation):
+    """Simulation2D holds the state of a particle in 2D, psi(x, y) in V(x, y), on an N by N grid of the same box in x and y.
+    The expressions are parsed with the “Function” class as functions of x and y, and psi is evolved with the “ADIOperation” of the “mechanics” module.
+    psi.x and V_x are (N, N) arrays indexed [y, x], the way images are."""
+    propagators = propagators_2d
+    variables = ["x", "y"]
+
+    def __init__(self, function="exp(-0.5*(((x-0.25)/0.05)**2 + (y/0.05)**2))", potential="(x**2 + y**2)/2", method="adi", method_options=None, defer_unitary=False, background_rebuilds=False, **constants):
+        """Initialize the simulation. The arguments are those of Simulation, but the expressions are functions of x and y, the arrays are (N, N)
+        and the only method is "adi". N is the number of grid points along each side, 256 unless it is given."""
+        constants.setdefault("N", 256)
+        super().__init__(function, potential, method=method, method_options=method_options, defer_unitary=defer_unitary, background_rebuilds=background_rebuilds, **constants)
+
+
+    def grid(self):
+        """Return the x and y coordinates of every grid point as two (N, N) arrays."""
+        return np.meshgrid(self.x, self.x)
+
+
+    def _sample(self, f, defaults):
+        """Evaluate the Function f of x and y with the parameter values defaults on the grid."""
+        X, Y = self.grid()
+        return np.array(np.broadcast_to(f(X, Y, *defaults), X.shape))
+
+
+    def set_wavefunction(self, psi, normalize=True):
+        """Parse input to set the wavefunction attributes. psi is an expression of x and y, a number or an (N, N) array."""
+        if isinstance(psi, str):
+            try:
+                psi = psi.replace("^", "**")
+                if psi.strip().replace(".", "").replace("-", "").replace("e", "").isnumeric():
+                    psi_x = float(psi)*np.ones([self.N, self.N])
+                    self.psi_name = psi
+                    self.psi_latex = "$%s$" % psi
+                    self.psi_base = None
+                    self.psi_params = {}
+                else:
+                    f = Function(psi, self.variables)
+                    psi_x = self._sample(f, f.get_tupled_default_values())
+                    self.psi_name = str(f)
+                    self.psi_latex = "$" + f.latex_repr + "$"
+                    self.psi_base = f
+                    self.psi_params = f.get_enumerated_default_values()
+                self.psi = WaveFunction2D(psi_x, **self._get_constant_dict())
+                self._msg = r"$\psi(x, y, 0) =$ %s" % self.psi_latex
+                self._msg_i = 45
+                if normalize:
+                    self.psi.normalize()
+            except (TypeError, AttributeError,SyntaxError, ValueError, NameError) as E:
+                print(E)
+        elif isinstance(psi, np.ndarray):
+            self.psi = WaveFunction2D(psi, **self._get_constant_dict())
+            self.psi_name = "wavefunction"
+            self.psi_latex = r"$\psi(x, y)$"
+            if normalize:
+                self.psi.normalize()
+        else:
+            print("Unable to parse input")
+        if hasattr(self, "psi"):
+            self.norm_monitor.reset(self.psi)
+            self.absorbed = 0.
+            self.absorption_rate = 0.
+
+
+    def set_unitary(self, V):
+        """Parse input and set the potential and the operator. V is an expression of x and y, a number or an (N, N) array."""
+        if isinstance(V, str):
+            try:
+                V = V.replace("^", "**")
+                if V.strip().replace(".", "").replace("-", "").replace("e", "").isnumeric():
+                    V_x = float(V)*np.ones([self.N, self.N])
+                    self.V = None
+                    self.V_name = ""
+                    self.V_latex = str(np.round(float(V), 2))
+                    self.V_base = None
+                    self.V_params = {}
+                else:
+                    f = Function(V, self.variables)
+                    defaults = f.get_tupled_default_values()
+                    V_x = self._sample(f, defaults)
+                    self.V = lambda x, y: f(x, y, *defaults)
+                    self.V_name = str(f)
+                    self.V_latex = "$" + f.multiply_latex_string("k") + "$"
+                    self.V_base = f
+                    self.V_params = f.get_enumerated_default_values()
+                self.V_x = V_x
+                self._build_unitary(np.copy(V_x))
+            except (TypeError, AttributeError,SyntaxError, ValueError, NameError) as E:
+                print(E)
+        elif isinstance(V, np.ndarray):
+            self.V_params = {}
+            self.V_base = None
+            self.V = None
+            self.V_x = V
+            self.V_name = "V(x, y)"
+            self.V_latex = "$V(x, y)$"
+            self._build_unitary(np.copy(V))
+        else:
+            print("Unable to parse input")
+
+
+    def advance(self, t, tolerance=1e-3):
+        """Advance the wavefunction by the time t and return the number of steps taken.
+        Adaptive steps are only implemented in 1D, so in 2D these are steps of dt and tolerance is not used."""
+        steps = int(round(t/self.dt))
+        self.run(steps)
+        return steps
+
+
+def main(argv=None):
+    """Run a headless simulation from the command line and save the result to a .npz file."""
+    parser = argparse.ArgumentParser(description="Headless single-particle 1D quantum simulation.")
+    parser.add_argument("--psi", default="exp(-0.5*((x-0.25)/0.05)**2)", help="initial wavefunction psi(x)")
+    parser.add_argument("--potential", default="(x)**2/2", help="potential V(x)")
+    parser.add_argument("-N", type=int, default=512, help="number of grid points")
+    parser.add_argument("--dt", type=float, default=1e-5, help="time step")
+    parser.add_argument("--steps", type=int, default=1000, help="number of time steps")
+    parser.add_argument("--method", default="crank-nicolson", choices=sorted(propagators), help="time evolution method")
+    parser.add_argument("--modes", type=int, default=None, help="eigenstates kept by the spectral method")
+    parser.add_argument("--every", type=int, default=0, help="save psi every this many steps, only the final psi if 0")
+    parser.add_argument("--adaptive", action="store_true", help="evolve for steps*dt with adaptive Crank-Nicolson steps instead")
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="relative error allowed in each adaptive step")
+    parser.add_argument("--observe", type=int, default=0, help="measure the norm, <x>, <p>, their spreads and the energy every this many steps")
+    parser.add_argument("--record", default=None, help="also record psi to this memory mapped file, see recorder.py")
+    parser.add_argument("--record-every", type=int, default=1, help="record psi every this many steps")
+    parser.add_argument("--compress", action="store_true", help="compress the recording in chunks")
+    parser.add_argument("--resume", default=None, help="continue from this checkpoint instead of starting from --psi and --potential")
+    parser.add_argument("--checkpoint", default=None, help="save a checkpoint with the operator to this file at the end")
+    parser.add_argument("--precision", default="single", choices=sorted(precisions), help="complex64 for throughput or complex128 for accuracy")
+    parser.add_argument("--absorber", type=float, default=0., help="width of the absorbing layer inside each wall, hard walls if 0")
+    parser.add_argument("--absorber-strength", type=float, default=5e4, help="height of the absorbing potential at the walls")
+    parser.add_argument("--timing", default=None, help="time the stages of every step and export them to this .json or .csv file, see timing.py")
+    parser.add_argument("--output", default="simulation.npz", help="output .npz file")
+    args = parser.parse_args(argv)
+    if args.timing is not None:
+        # Enabled before the expressions are parsed and the operator is built, so that those are timed too
+        timers.enabled = True
+    method_options = {"modes": args.modes} if args.method == "spectral" else {}
+    if args.resume is not None:
+        sim = Simulation.from_checkpoint(args.resume)
+    else:
+        sim = Simulation(args.psi, args.potential, method=args.method, method_options=method_options, N=args.N, dt=args.dt, precision=args.precision,
+                         absorber=args.absorber, absorber_strength=args.absorber_strength)
+    if args.observe > 0:
+        observables = Observables(sim, every=args.observe, maxlen=None)
+        observables.record()
+        observables.attach()
+    if args.record is not None:
+        recorder = TrajectoryRecorder(args.record, np.shape(sim.psi.x), args.record_every, compress=args.compress)
+        recorder.attach(sim)
+    if args.timing is not None:
+        sim.observers.append(timers)
+    if args.adaptive:
+        times, snapshots = [], []
+        every = args.every if args.every > 0 else args.steps
+        for start in range(0, args.steps, every):
+            sim.advance(min(every, args.steps - start)*args.dt, args.tolerance)
+            if args.every > 0:
+                times.append(sim._t)
+                snapshots.append(np.copy(sim.psi.x))
+        times, snapshots = np.array(times), np.array(snapshots)
+    else:
+        times, snapshots = sim.run(args.steps, args.every)
+    if args.record is not None:
+        recorder.close()
+    if args.checkpoint is not None:
+        sim.save_checkpoint(args.checkpoint, operator=True)
+    if args.timing is not None:
+        timers.export(args.timing)
+        print(timers.report())
+    results = {}
+    if args.observe > 0:
+        results = {"observables_" + name: value for name, value in observables.series().items()}
+    np.savez(args.output, x=sim.x, V_x=sim.V_x, t=sim._t, psi=sim.psi.x, times=times, snapshots=snapshots, absorbed=sim.absorbed, **results)
+    if sim.absorber > 0:
+        print("The absorbing layers took a probability of %s" % np.round(sim.absorbed, 6))
+    print("Saved %d steps of %s to %s" % (args.steps, sim.psi_name, args.output))
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
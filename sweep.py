@@ -0,0 +1,150 @@
+"""
+sweep.py
+
+Parameter sweeps over the free parameters of the wavefunction and potential expressions.
+Every configuration of parameter values is evolved headlessly in a process pool, and the chosen observables of the final states,
+optionally with the final states themselves, are collected into one table with a row per configuration.
+The expressions are parsed once per process and the x grid is shared between the processes through shared memory.
+Configurations with the same potential reuse its operator through the propagator cache of their process.
+
+Run this file for a sweep from the command line, for example
+python sweep.py --psi "exp(-0.5*((x-a)/0.05)**2)" --potential "b*x**2/2" --param a=-0.2:0.2:9 --param b=0.5,1,2 --steps 2000 --output sweep.csv
+"""
+
+#import statements
+import argparse
+import csv
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from multiprocessing import shared_memory
+from collection import Function, constant, evaluate
+from mechanics import propagators
+from observables import Observables, names
+from simulation import Simulation
+
+# The state of each worker process, set up once by _init_worker
+_worker = {}
+
+
+def grid(**axes):
+    """Return the configurations of every combination of the given parameter values, for example grid(a=[0, 1], b=[1, 2, 3]) gives 6."""
+    keys = list(axes)
+    return [dict(zip(keys, values)) for values in product(*(axes[key] for key in keys))]
+
+
+def parse_values(text):
+    """Parse the values of one parameter from the command line, either start:stop:num for evenly spaced values or a comma separated list."""
+    if ":" in text:
+        start, stop, num = text.split(":")
+        return list(np.linspace(float(start), float(stop), int(num)))
+    return [float(value) for value in text.split(",")]
+
+
+def _parse(expression):
+    """Parse an expression of x into a Function, or return it unchanged if it is a number, which Simulation takes without parsing."""
+    if expression.strip().replace(".", "").replace("-", "").replace("e", "").isnumeric():
+        return expression
+    return Function(expression.replace("^", "**"), "x")
+
+
+def _evaluate(base, x, config):
+    """Evaluate a parsed expression on x with the parameter values of config, and the default values of the parameters it does not set."""
+    if isinstance(base, str):
+        return base
+    defaults = base.get_default_values()
+    args = [config.get(str(s), defaults[s]) for s in base.parameters]
+    return evaluate(lambda x: base(x, *args), x)
+
+
+def _init_worker(psi, potential, shm_name, N, settings):
+    """Set up a worker process: attach to the shared x grid and parse the expressions once."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    # The handle is kept so that the shared block stays mapped for as long as the process runs
+    _worker["shm"] = shm
+    _worker["x"] = np.ndarray((N,), np.float64, buffer=shm.buf)
+    _worker["psi"] = _parse(psi)
+    _worker["potential"] = _parse(potential)
+    _worker["settings"] = settings
+
+
+def _run(config):
+    """Evolve one configuration and return its row of the table, and its final state if it is kept."""
+    x = _worker["x"]
+    steps, method, method_options, observed, final_state, constants = _worker["settings"]
+    sim = Simulation(_evaluate(_worker["psi"], x, config), _evaluate(_worker["potential"], x, config),
+                     method=method, method_options=method_options, **constants)
+    sim.run(steps)
+    sample = Observables(sim).measure()
+    row = {name: float(np.real(sample[name])) for name in observed}
+    return row, (np.array(sim.psi.x) if final_state else None)
+
+
+def sweep(psi, potential, configurations, steps, method="crank-nicolson", method_options=None, observed=names, final_state=False, processes=None, **constants):
+    """Evolve psi in potential for steps time steps for every configuration, a dict of parameter values such as the ones grid() makes.
+    Returns the table as a dict of columns, the parameters followed by the observables in observed, each an array with an entry per configuration.
+    With final_state the final wavefunctions are added as the column "psi", an array of shape (configurations, N).
+    processes is the number of worker processes, all cores if None. constants are passed on to Simulation, for example N=4096."""
+    C = constant(**constants)
+    x = np.linspace(C.x0, (C.L + C.x0), C.N)
+    shm = shared_memory.SharedMemory(create=True, size=x.nbytes)
+    try:
+        np.ndarray(x.shape, x.dtype, buffer=shm.buf)[...] = x
+        settings = (steps, method, method_options, tuple(observed), final_state, constants)
+        processes = processes or os.cpu_count()
+        with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(psi, potential, shm.name, C.N, settings)) as executor:
+            # A few chunks per process keep the processes busy without sending every configuration on its own
+            results = list(executor.map(_run, configurations, chunksize=max(1, len(configurations)//(4*processes))))
+    finally:
+        shm.close()
+        shm.unlink()
+    parameters = []
+    for config in configurations:
+        parameters += [key for key in config if key not in parameters]
+    table = {key: np.array([config.get(key, np.nan) for config in configurations]) for key in parameters}
+    for name in observed:
+        table[name] = np.array([row[name] for row, _ in results])
+    if final_state:
+        table["psi"] = np.array([state for _, state in results])
+    return table
+
+
+def write_csv(table, path):
+    """Write the table of a sweep to a CSV file, leaving out the final states."""
+    columns = [key for key in table if key != "psi"]
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(zip(*(table[key] for key in columns)))
+
+
+def main(argv=None):
+    """Run a parameter sweep from the command line and save the table to a CSV file."""
+    parser = argparse.ArgumentParser(description="Parameter sweep of a headless single-particle 1D quantum simulation.")
+    parser.add_argument("--psi", default="exp(-0.5*((x-a)/0.05)**2)", help="initial wavefunction psi(x), with free parameters")
+    parser.add_argument("--potential", default="(x)**2/2", help="potential V(x), with free parameters")
+    parser.add_argument("--param", action="append", default=[], help="values of one parameter, name=start:stop:num or name=v1,v2,...")
+    parser.add_argument("-N", type=int, default=512, help="number of grid points")
+    parser.add_argument("--dt", type=float, default=1e-5, help="time step")
+    parser.add_argument("--steps", type=int, default=1000, help="number of time steps")
+    parser.add_argument("--method", default="crank-nicolson", choices=sorted(propagators), help="time evolution method")
+    parser.add_argument("--processes", type=int, default=None, help="number of worker processes, all cores by default")
+    parser.add_argument("--final-state", default=None, help="also save the final wavefunctions to this .npy file")
+    parser.add_argument("--output", default="sweep.csv", help="output CSV file")
+    args = parser.parse_args(argv)
+    axes = {}
+    for param in args.param:
+        name, values = param.split("=")
+        axes[name.strip()] = parse_values(values)
+    configurations = grid(**axes)
+    table = sweep(args.psi, args.potential, configurations, args.steps, method=args.method, final_state=args.final_state is not None,
+                  processes=args.processes, N=args.N, dt=args.dt)
+    write_csv(table, args.output)
+    if args.final_state is not None:
+        np.save(args.final_state, table["psi"])
+    print("Saved %d configurations to %s" % (len(configurations), args.output))
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,163 @@
+"""
+timing.py
+
+Switchable timers around the stages of the simulation and the animation.
+It contains the class StageTimer and its shared instance timers. Code marks a stage with "with timers.stage(name):", and while the timers
+are enabled the seconds spent in each stage are added up per frame and kept in a rolling window, from which histograms and summaries are made.
+While they are disabled a stage costs one attribute lookup and a call, so the marks can stay in the hot paths.
+The summaries can be exported to a JSON or CSV file, or drawn over the plot by Quantum.
+
+This module is only a collection of classes, so there is no point in running it.
+"""
+
+#import statements
+import csv
+import json
+import threading
+from collections import deque
+from contextlib import nullcontext
+from time import perf_counter
+import numpy as np
+
+# The stage used while the timers are disabled
+_disabled = nullcontext()
+
+
+class _Stage:
+    """The context manager of one stage, which adds the seconds spent inside it to the current frame."""
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+
+    def __enter__(self):
+        self.t0 = perf_counter()
+
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, perf_counter() - self.t0)
+
+
+class StageTimer:
+    """Timers of the stages of a frame, such as "operator build", "evolution", "fft", "observables", "line updates", "blit" and "parse".
+    The seconds of each stage are summed until tick() ends the frame. The sums of the last window frames are kept,
+    together with the length of the frames themselves as the stage "frame". Stages may be nested, a stage then includes the ones inside it."""
+
+    def __init__(self, enabled=False, window=600):
+        """Initialize the timers, disabled unless enabled is True."""
+        self.enabled = enabled
+        self.window = window
+        self.every = 1   # As an observer of a simulation, see __call__
+        self.history = deque(maxlen=window)   # The seconds of each stage timed in a frame as a dict per frame, newest last
+        self._frame = {}
+        self._last_tick = None
+        # Stages can be timed from the physics worker and the Tkinter thread at the same time
+        self._lock = threading.Lock()
+
+
+    def stage(self, name):
+        """Return the context manager that times the stage name, or one that does nothing while the timers are disabled."""
+        if not self.enabled:
+            return _disabled
+        return _Stage(self, name)
+
+
+    def add(self, name, seconds):
+        """Add seconds to the stage name of the current frame."""
+        with self._lock:
+            self._frame[name] = self._frame.get(name, 0.0) + seconds
+
+
+    def tick(self):
+        """End the current frame: keep the seconds of each stage in it and the length of the frame, and start a new one."""
+        if not self.enabled:
+            self._last_tick = None
+            return
+        now = perf_counter()
+        with self._lock:
+            frame, self._frame = self._frame, {}
+            if self._last_tick is not None:
+                frame["frame"] = now - self._last_tick
+            self.history.append(frame)
+        self._last_tick = now
+
+
+    def __call__(self, steps=1):
+        """End the frame, so that the timers can be one of Simulation.observers and time every step of a headless run as one frame."""
+        self.tick()
+
+
+    def reset(self):
+        """Forget every frame timed so far."""
+        with self._lock:
+            self.history.clear()
+            self._frame = {}
+        self._last_tick = None
+
+
+    def stages(self):
+        """Return the names of the stages timed in the kept frames, in the order they were first timed."""
+        names = {}
+        for frame in list(self.history):
+            names.update(dict.fromkeys(frame))
+        return list(names)
+
+
+    def seconds(self, name):
+        """Return the seconds of the stage name in each of the kept frames it was timed in, oldest first."""
+        return np.array([frame[name] for frame in list(self.history) if name in frame])
+
+
+    def histogram(self, name, bins=20):
+        """Return the counts and the bin edges, in seconds and evenly spaced in log, of the per frame seconds of the stage name."""
+        seconds = self.seconds(name)
+        seconds = seconds[seconds > 0]
+        if len(seconds) == 0:
+            return np.zeros(bins, np.int64), np.zeros(bins + 1)
+        counts, edges = np.histogram(np.log10(seconds), bins=bins)
+        return counts, 10**edges
+
+
+    def summary(self):
+        """Return the mean, median, 95th percentile and maximum per frame seconds of every stage, and the number of frames it was timed in."""
+        result = {}
+        for name in self.stages():
+            seconds = self.seconds(name)
+            result[name] = {"frames": len(seconds), "mean": float(np.mean(seconds)), "median": float(np.median(seconds)),
+                            "p95": float(np.percentile(seconds, 95)), "max": float(np.max(seconds))}
+        return result
+
+
+    def report(self):
+        """Return the summary as lines of text, the slowest stage first, the way the overlay on the plot shows it."""
+        summary = self.summary()
+        frame = summary.pop("frame", None)
+        lines = []
+        if frame is not None:
+            lines.append("frame %6.2f ms (%.0f fps)" % (frame["mean"]*1e3, 1/max(frame["mean"], 1e-9)))
+        for name, stats in sorted(summary.items(), key=lambda item: -item[1]["mean"]):
+            lines.append("%-14s %6.2f ms  p95 %6.2f ms" % (name, stats["mean"]*1e3, stats["p95"]*1e3))
+        return "\n".join(lines)
+
+
+    def export(self, path, bins=20):
+        """Write the timings to path: the summary and the histograms as JSON, or the seconds of every stage with a row per frame as CSV
+        if path ends in .csv, where a stage that was not timed in a frame is left empty."""
+        names = self.stages()
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(names)
+                writer.writerows([frame.get(name, "") for name in names] for frame in list(self.history))
+        else:
+            histograms = {}
+            for name in names:
+                counts, edges = self.histogram(name, bins)
+                histograms[name] = {"counts": counts.tolist(), "edges": edges.tolist()}
+            with open(path, "w") as f:
+                json.dump({"summary": self.summary(), "histograms": histograms}, f, indent=1)
+
+
+# The timers shared by every module, disabled until timers.enabled is set
+timers = StageTimer()
\ No newline at end of file
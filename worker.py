@@ -0,0 +1,105 @@
+"""
+worker.py
+
+Background time evolution for the animation.
+It contains the class FrameBuffer, a bounded ring buffer of preallocated wavefunction snapshots,
+and the class PhysicsWorker, a thread that keeps stepping a Simulation and publishes its snapshots into a FrameBuffer.
+The display only reads the newest snapshot, so a slow redraw does not hold up the physics and a slow step does not freeze the window.
+NumPy's FFTs and BLAS/LAPACK calls release the GIL, so the worker and the Tkinter main thread run side by side.
+
+This module is only a collection of classes, so there is no point in running it.
+"""
+
+#import statements
+import threading
+import numpy as np
+from time import perf_counter, sleep
+
+
+class FrameBuffer:
+    """A bounded ring buffer of wavefunction snapshots.
+    All the memory is allocated up front, writing copies into the oldest slot and reading copies the newest slot out.
+    Snapshots keep their dtype: after a change of precision the buffer is allocated again in the new one instead of casting into the old one."""
+
+    def __init__(self, shape, capacity=8, dtype=np.complex128):
+        """Initialize capacity empty snapshots of the given shape."""
+        self.capacity = capacity
+        self.frames = np.zeros((capacity,) + tuple(shape), dtype)
+        self.times = np.zeros([capacity])
+        self.written = 0   # Number of snapshots written so far
+        self._lock = threading.Lock()
+
+
+    def write(self, psi, t):
+        """Copy the wavefunction psi at time t into the next slot, overwriting the oldest snapshot."""
+        with self._lock:
+            if psi.dtype != self.frames.dtype:
+                self.frames = np.zeros(self.frames.shape, psi.dtype)
+            i = self.written % self.capacity
+            self.frames[i] = psi
+            self.times[i] = t
+            self.written += 1
+
+
+    @property
+    def dtype(self):
+        """The dtype of the newest snapshots, which latest() should copy into an array of the same dtype."""
+        return self.frames.dtype
+
+
+    def latest(self, out):
+        """Copy the newest snapshot into out and return its time, or None if nothing was written yet."""
+        with self._lock:
+            if self.written == 0:
+                return None
+            i = (self.written - 1) % self.capacity
+            out[...] = self.frames[i]
+            return self.times[i]
+
+
+class PhysicsWorker(threading.Thread):
+    """A thread that advances a Simulation by fpi time steps at a time and publishes each result into a FrameBuffer.
+    rate is the number of steps of fpi time evolutions per second, or None to step as fast as possible."""
+
+    def __init__(self, simulation, frames, rate=None):
+        """Initialize the worker. It starts stepping once start() is called."""
+        super().__init__(daemon=True)
+        self.simulation = simulation
+        self.frames = frames
+        self.rate = rate
+        self.steps_per_second = 0.0   # Measured physics rate
+        self._stop_event = threading.Event()
+
+
+    def run(self):
+        """Step the simulation until stop() is called."""
+        t_last = perf_counter()
+        steps = 0
+        while not self._stop_event.is_set():
+            t_step = perf_counter()
+            sim = self.simulation
+            if sim.fpi == 0 or sim.U_t is None:
+                # Paused, or the operator is still being built. Keep publishing psi so that edits made while paused are shown.
+                with sim.lock:
+                    self.frames.write(sim.psi.x, sim._t)
+                sleep(0.01)
+                continue
+            with sim.lock:
+                sim.step()
+                self.frames.write(sim.psi.x, sim._t)
+            steps += 1
+            if t_step - t_last > 1.0:
+                self.steps_per_second = steps/(t_step - t_last)
+                t_last, steps = t_step, 0
+            if self.rate is not None:
+                sleep(max(0.0, 1.0/self.rate - (perf_counter() - t_step)))
+            else:
+                # Give the main thread a chance to take the GIL between steps
+                sleep(0)
+
+
+    def stop(self):
+        """Stop stepping and wait for the current step to finish."""
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
\ No newline at end of file